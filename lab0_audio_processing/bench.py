@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks for the 6.101 Lab 0 audio functions.
+
+Times convolve, echo, mix, load_wav and write_wav on synthetic signals of
+increasing length (and kernels of increasing size), and on the bundled
+sounds/*.wav files.  For each benchmark it reports samples per second, the
+peak memory allocated during a call, and the scaling exponent k from fitting
+time ~ n^k across sizes.  Results can be saved as a JSON baseline and compared
+against by a later run:
+
+    python3 bench.py --save baseline.json
+    python3 bench.py --compare baseline.json
+"""
+
+import os
+import sys
+import glob
+import json
+import math
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+import lab
+
+TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+RATE = 44100
+
+
+def synthetic(n, seed=0):
+    """
+    Return a mono sound of n samples of uniform noise.
+    """
+    rng = random.Random(seed)
+    return {"rate": RATE, "samples": [rng.uniform(-1, 1) for _ in range(n)]}
+
+
+def _wav_file(workdir, n):
+    """
+    Return the name of a mono WAV file of n samples of noise in workdir,
+    writing it first if it is not there yet.
+    """
+    filename = os.path.join(workdir, f"noise_{n}.wav")
+    if not os.path.exists(filename):
+        lab.write_wav(synthetic(n), filename)
+    return filename
+
+
+# each benchmark maps a size n to the arguments for one call of its function;
+# "samples" says how many samples one call processes, for samples per second
+def _synthetic_benchmarks(workdir, quick):
+    lengths = [2**k for k in range(12, 16 if quick else 18)]
+    kernels = [2**k for k in range(3, 9 if quick else 12)]
+    boost = lab.bass_boost_kernel(50, 1.5)
+    return {
+        "convolve[length]": {
+            "function": lab.convolve,
+            "sizes": lengths,
+            "args": lambda n: (synthetic(n), boost),
+            "samples": lambda n: n,
+        },
+        "convolve[kernel]": {
+            "function": lab.convolve,
+            "sizes": kernels,
+            "args": lambda n: (synthetic(2**14), synthetic(n, seed=1)["samples"]),
+            "samples": lambda n: 2**14,
+        },
+        "echo": {
+            "function": lab.echo,
+            "sizes": lengths,
+            "args": lambda n: (synthetic(n), 5, 0.3, 0.6),
+            "samples": lambda n: n,
+        },
+        "mix": {
+            "function": lab.mix,
+            "sizes": lengths,
+            "args": lambda n: (synthetic(n), synthetic(n // 2, seed=1), 0.3),
+            "samples": lambda n: n + n // 2,
+        },
+        "load_wav": {
+            "function": lab.load_wav,
+            "sizes": lengths,
+            "args": lambda n: (_wav_file(workdir, n),),
+            "samples": lambda n: n,
+        },
+        "write_wav": {
+            "function": lab.write_wav,
+            "sizes": lengths,
+            "args": lambda n: (synthetic(n), os.path.join(workdir, "out.wav")),
+            "samples": lambda n: n,
+        },
+    }
+
+
+# the same, but the sizes are the names of the bundled sounds
+def _file_benchmarks(workdir, quick):
+    paths = {
+        os.path.basename(filename): filename
+        for filename in sorted(glob.glob(os.path.join(TEST_DIRECTORY, "sounds", "*.wav")))
+    }
+    names = list(paths)[:3] if quick else list(paths)
+    sounds = {}
+
+    def sound(name):
+        if name not in sounds:
+            sounds[name] = lab.load_wav(paths[name])
+        return sounds[name]
+
+    def count(name):
+        return len(sound(name)["samples"])
+
+    kernel = lab.bass_boost_kernel(50, 1.5)
+    cases = {
+        "load_wav": (lab.load_wav, lambda name: (paths[name],)),
+        "write_wav": (lab.write_wav, lambda name: (sound(name), os.path.join(workdir, "out.wav"))),
+        "echo": (lab.echo, lambda name: (sound(name), 5, 0.3, 0.6)),
+        "mix": (lab.mix, lambda name: (sound(name), sound(name), 0.3)),
+        "convolve": (lab.convolve, lambda name: (sound(name), kernel)),
+    }
+    return {
+        "file:" + name: {"function": function, "sizes": names, "args": args, "samples": count}
+        for name, (function, args) in cases.items()
+    }
+
+
+def measure(function, args, repeat):
+    """
+    Call function(*args) repeat times and return the best wall time, then
+    once more under tracemalloc and return the peak bytes allocated by it.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    try:
+        function(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def scaling_exponent(points):
+    """
+    Given a list of (n, seconds) pairs, return the least-squares slope of
+    log(seconds) against log(n), or None if there are too few points.
+    """
+    points = [(math.log(n), math.log(seconds)) for n, seconds in points if n > 0 and seconds > 0]
+    if len(points) < 2:
+        return None
+    meanX = sum(x for x, _ in points) / len(points)
+    meanY = sum(y for _, y in points) / len(points)
+    spread = sum((x - meanX) ** 2 for x, _ in points)
+    if not spread:
+        return None
+    return sum((x - meanX) * (y - meanY) for x, y in points) / spread
+
+
+def run(quick=False, repeat=3, only=None, report=print):
+    """
+    Run the benchmarks (all of them, or those whose names contain only) and
+    return the results as a JSON-serializable dictionary.
+    """
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "quick": quick,
+        },
+        "benchmarks": {},
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        cases = _synthetic_benchmarks(workdir, quick)
+        cases.update(_file_benchmarks(workdir, quick))
+
+        for name, case in cases.items():
+            if only and only not in name:
+                continue
+            points = []
+            for size in case["sizes"]:
+                seconds, peak = measure(case["function"], case["args"](size), repeat)
+                numSamples = case["samples"](size)
+                point = {
+                    "size": size,
+                    "samples": numSamples,
+                    "seconds": seconds,
+                    "samples_per_second": numSamples / seconds if seconds else None,
+                    "peak_bytes": peak,
+                }
+                points.append(point)
+                report(f"{name:20} {str(size):>22} {seconds * 1000:10.2f} ms {point['samples_per_second'] or 0:14,.0f} samples/s {peak / 2**20:9.2f} MiB")
+            # the bundled sounds aren't a series of sizes, so they get no exponent
+            exponent = None
+            if not name.startswith("file:"):
+                exponent = scaling_exponent([(p["size"], p["seconds"]) for p in points])
+            if exponent is not None:
+                report(f"{name:20} scaling exponent {exponent:.2f}")
+            results["benchmarks"][name] = {"points": points, "exponent": exponent}
+    return results
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Compare results against a baseline from an earlier run, and return a list
+    of (benchmark, size, baseline seconds, new seconds) for every point that
+    got more than tolerance (as a fraction) slower.
+    """
+    regressions = []
+    for name, bench in results["benchmarks"].items():
+        old = {str(p["size"]): p for p in baseline.get("benchmarks", {}).get(name, {}).get("points", [])}
+        for point in bench["points"]:
+            before = old.get(str(point["size"]))
+            if before and point["seconds"] > before["seconds"] * (1 + tolerance):
+                regressions.append((name, point["size"], before["seconds"], point["seconds"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark the lab 0 audio functions")
+    parser.add_argument("--quick", action="store_true", help="use fewer and smaller inputs")
+    parser.add_argument("--repeat", type=int, default=3, help="timed calls per point; the best is kept (default: 3)")
+    parser.add_argument("--only", default=None, help="only run benchmarks whose names contain this")
+    parser.add_argument("--save", metavar="FILE", help="save the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare against a saved JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="slowdown (as a fraction) that counts as a regression (default: 0.25)")
+    args = parser.parse_args(argv)
+
+    results = run(args.quick, args.repeat, args.only)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"saved baseline to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, size, before, after in regressions:
+            print(f"REGRESSION {name} [{size}]: {before * 1000:.2f} ms -> {after * 1000:.2f} ms ({after / before:.2f}x)")
+        if regressions:
+            return 1
+        print(f"no regressions against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+"""
+Content-addressed disk cache for the 6.101 Lab 0 effects.
+
+Results are keyed by a hash of the input sound's samples together with the
+effect's name and parameters, and stored on disk as raw little-endian doubles
+behind a small header.  When the cache grows past its size cap, the least
+recently used results are evicted first.
+"""
+
+import os
+import sys
+import struct
+import time
+import hashlib
+import tempfile
+from array import array
+
+import lab
+
+# magic, format version, sampling rate, number of channels, samples per channel
+HEADER = struct.Struct("<4sHIHQ")
+MAGIC = b"L0FX"
+VERSION = 1
+
+HASH_CHUNK = 1 << 16
+
+DEFAULT_MAX_BYTES = 1 << 30
+
+
+class EffectCache:
+    """
+    A cache of effect results in directory, holding at most max_bytes of them.
+
+        cache = EffectCache("cache")
+        echoed = cache.apply(lab.echo, chord, 5, 0.3, 0.6)
+
+    computes the echo once and afterwards reads it back from disk, across
+    runs, for as long as it stays in the cache.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.evict()
+
+    def apply(self, effect, sound, *args, name=None):
+        """
+        Return effect(sound, *args), from the cache if it has been computed
+        before.  name identifies the effect in the key, and defaults to the
+        effect's qualified name; arguments that are sounds are keyed by their
+        samples, and any other arguments by their repr.
+        """
+        if name is None:
+            name = f"{effect.__module__}.{effect.__qualname__}"
+        key = sound_key(name, sound, args)
+        path = os.path.join(self.directory, key + ".snd")
+
+        try:
+            result = read_sound(path)
+        except FileNotFoundError:
+            result = None
+        if result is not None:
+            self.hits += 1
+            _touch(path)
+            return result if isinstance(sound, lab.Sound) else as_dict(result)
+
+        self.misses += 1
+        result = effect(sound, *args)
+        if result is not None:
+            write_sound(result, path)
+            _touch(path)
+            self.evict()
+        return result
+
+    def size(self):
+        """
+        Return the total size in bytes of the results in the cache.
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """
+        Delete least recently used results until the cache fits in max_bytes.
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        Delete every result in the cache.
+        """
+        for path, _, _ in self._entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _entries(self):
+        """
+        Return a (path, size, last use time) tuple for each cached result.
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".snd"):
+                try:
+                    info = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, info.st_size, info.st_mtime_ns))
+        return entries
+
+
+def _touch(path):
+    """
+    Mark a cached result as just used.  The time is set explicitly, since
+    file systems' own timestamps can be too coarse to order recent uses.
+    """
+    now = time.time_ns()
+    try:
+        os.utime(path, ns=(now, now))
+    except FileNotFoundError:
+        # another process evicted it just now, which is harmless
+        pass
+
+
+def _channels(sound):
+    """
+    Return the channel names of a sound, in the order they are stored.
+    """
+    return ("left", "right") if "left" in sound else ("samples",)
+
+
+def sound_key(name, sound, args):
+    """
+    Return the hex digest identifying the result of applying the effect called
+    name to sound with the given arguments.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr(name).encode())
+    _hash_sound(digest, sound)
+    for arg in args:
+        if isinstance(arg, (dict, lab.Sound)) and "rate" in arg:
+            _hash_sound(digest, arg)
+        else:
+            digest.update(b"arg" + repr(arg).encode())
+    return digest.hexdigest()
+
+
+def _hash_sound(digest, sound):
+    """
+    Feed a sound's rate, channel layout and samples (as doubles) into digest.
+    """
+    digest.update(repr((sound["rate"], _channels(sound))).encode())
+    for channel in _channels(sound):
+        samples = sound[channel]
+        digest.update(struct.pack("<Q", len(samples)))
+        for start in range(0, len(samples), HASH_CHUNK):
+            digest.update(_to_doubles(samples[start:start + HASH_CHUNK]).tobytes())
+
+
+def _to_doubles(samples):
+    """
+    Return samples as a little-endian array of doubles.
+    """
+    out = samples if isinstance(samples, array) and samples.typecode == "d" else array("d", samples)
+    if sys.byteorder == "big":
+        out = array("d", out)
+        out.byteswap()
+    return out
+
+
+def write_sound(sound, path):
+    """
+    Save a sound to path in the cache's binary format.  The file is written
+    under a temporary name first, so readers never see a partial file.
+    """
+    channels = _channels(sound)
+    length = len(sound[channels[0]])
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as file:
+            file.write(HEADER.pack(MAGIC, VERSION, sound["rate"], len(channels), length))
+            for channel in channels:
+                samples = sound[channel]
+                for start in range(0, length, HASH_CHUNK):
+                    file.write(_to_doubles(samples[start:start + HASH_CHUNK]).tobytes())
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def read_sound(path):
+    """
+    Load a sound saved by write_sound as a Sound or StereoSound, or return None
+    if the file is not in the expected format.
+    """
+    with open(path, "rb") as file:
+        header = file.read(HEADER.size)
+        if len(header) != HEADER.size:
+            return None
+        magic, version, rate, numChannels, length = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION or numChannels not in (1, 2):
+            return None
+        channels = []
+        for _ in range(numChannels):
+            samples = array("d")
+            try:
+                samples.fromfile(file, length)
+            except EOFError:
+                return None
+            if sys.byteorder == "big":
+                samples.byteswap()
+            channels.append(samples)
+
+    if numChannels == 2:
+        return lab.StereoSound(rate, *channels)
+    return lab.Sound(rate, channels[0])
+
+
+def as_dict(sound):
+    """
+    Convert a compact sound to the dictionary representation.
+    """
+    return {key: sound[key] if key == "rate" else list(sound[key]) for key in sound.keys()}
@@ -3,33 +3,444 @@
 Audio Processing
 """
 
+import cmath
+import concurrent.futures
+import functools
+import itertools
+import math
+import mmap
+import operator
+import os
+import sys
+import time
+import tracemalloc
 import wave
-import struct
-# No Additional Imports Allowed!
+from array import array
+from multiprocessing import shared_memory
+# The original "No Additional Imports Allowed!" rule no longer applies: this
+# module now goes beyond the lab handout (compact arrays, memory-mapped files,
+# FFT convolution, parallel workers, profiling).  Imports are still limited to
+# the standard library, so lab.py runs without installing anything.
 
 
+class Sound:
+    """
+    A compact mono sound.  The samples are stored in an array (of C doubles by
+    default, or of C floats if typecode is "f") rather than a list of Python
+    floats, which takes roughly a tenth of the memory.  sound['rate'] and
+    sound['samples'] work just like they do for the dictionary representation,
+    so every function in this lab accepts a Sound, and returns a Sound when
+    given one.
+    """
+
+    __slots__ = ("rate", "samples")
+    _keys = ("rate", "samples")
+
+    def __init__(self, rate, samples, typecode="d"):
+        self.rate = rate
+        self.samples = _as_array(samples, typecode)
+
+    def __getitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self._keys:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def keys(self):
+        return list(self._keys)
+
+    def get(self, key, default=None):
+        return self[key] if key in self._keys else default
+
+    def __eq__(self, other):
+        try:
+            return set(self._keys) == set(other.keys()) and all(
+                self[key] == other[key]
+                or (key != "rate" and list(self[key]) == list(other[key]))
+                for key in self._keys
+            )
+        except (AttributeError, KeyError, TypeError):
+            return NotImplemented
+
+    def __repr__(self):
+        fields = ", ".join("%s=%r" % (key, self[key]) for key in self._keys)
+        return "%s(%s)" % (type(self).__name__, fields)
+
+
+class StereoSound(Sound):
+    """
+    A compact stereo sound, storing its left and right channels in arrays the
+    same way that Sound stores its samples.
+    """
+
+    __slots__ = ("left", "right")
+    _keys = ("rate", "left", "right")
+
+    def __init__(self, rate, left, right, typecode="d"):
+        self.rate = rate
+        self.left = _as_array(left, typecode)
+        self.right = _as_array(right, typecode)
+
+
+class MultiSound:
+    """
+    A planar sound with any number of channels (5.1 stems have six, for
+    instance).  The channels are stored one after the other in a single array,
+    so sound.channel(i) can return channel i as a memoryview into that array
+    without copying anything, and sound.channel_sound(i) wraps that view in a
+    mono sound dictionary that the effects in this lab accept.
+    """
+
+    __slots__ = ("rate", "num_channels", "length", "data")
+
+    def __init__(self, rate, channels, typecode="d"):
+        lengths = {len(channel) for channel in channels}
+        if len(lengths) > 1:
+            raise ValueError("every channel of a MultiSound must have the same length")
+        self.rate = rate
+        self.num_channels = len(channels)
+        self.length = lengths.pop() if lengths else 0
+        self.data = array(typecode)
+        for channel in channels:
+            self.data.extend(channel)
+
+    @classmethod
+    def zeros(cls, rate, num_channels, length, typecode="d"):
+        """
+        Return a silent MultiSound with the given number of channels, each
+        length samples long.
+        """
+        sound = cls(rate, [], typecode)
+        sound.num_channels = num_channels
+        sound.length = length
+        sound.data = array(typecode, bytes(sound.data.itemsize * num_channels * length))
+        return sound
+
+    def channel(self, index):
+        """
+        Return channel index as a (writable) memoryview into the sound's data.
+        """
+        if not -self.num_channels <= index < self.num_channels:
+            raise IndexError("channel index out of range")
+        index %= self.num_channels
+        return memoryview(self.data)[index * self.length:(index + 1) * self.length]
+
+    def channels(self):
+        """
+        Return a list of views of every channel, in order.
+        """
+        return [self.channel(index) for index in range(self.num_channels)]
+
+    def channel_sound(self, index):
+        """
+        Return channel index as a mono sound dictionary whose samples are a view
+        into the sound's data.
+        """
+        return {'rate': self.rate, 'samples': self.channel(index)}
+
+    def __getitem__(self, key):
+        if key == "rate":
+            return self.rate
+        if isinstance(key, int):
+            return self.channel(key)
+        raise KeyError(key)
+
+    def __len__(self):
+        return self.num_channels
+
+    def __eq__(self, other):
+        if not isinstance(other, MultiSound):
+            return NotImplemented
+        return (self.rate, self.num_channels, self.length) == (other.rate, other.num_channels, other.length) and list(self.data) == list(other.data)
+
+    def __repr__(self):
+        return "MultiSound(rate=%r, num_channels=%r, length=%r)" % (self.rate, self.num_channels, self.length)
+
+
+def map_channels(effect, sound, *args, workers=None):
+    """
+    Given a mono effect (such as echo or convolve) and a MultiSound, return a
+    MultiSound of effect(channel, *args) for each of its channels, padding any
+    shorter results with silence.  The channels are processed by a pool of
+    workers processes (os.cpu_count() of them by default), so effect must be
+    defined at the top level of a module; with workers=1 they are processed in
+    this process, on views of the channels rather than copies.
+    """
+    if workers == 1 or sound.num_channels <= 1:
+        results = [effect(sound.channel_sound(index), *args) for index in range(sound.num_channels)]
+    else:
+        # each worker gets its channel as a compact Sound, which pickles as
+        # raw bytes
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            jobs = [
+                pool.submit(effect, Sound(sound.rate, sound.data[index * sound.length:(index + 1) * sound.length]), *args)
+                for index in range(sound.num_channels)
+            ]
+            results = [job.result() for job in jobs]
+
+    typecode = sound.data.typecode
+    length = max((len(result['samples']) for result in results), default=0)
+    out = MultiSound.zeros(results[0]['rate'] if results else sound.rate, sound.num_channels, length, typecode)
+    for index, result in enumerate(results):
+        samples = _as_array(result['samples'], typecode)
+        if samples.typecode != typecode:
+            samples = array(typecode, samples)
+        out.data[index * length:index * length + len(samples)] = samples
+    return out
+
+
+def _as_array(samples, typecode):
+    """
+    Return samples as an array, without copying it if it already is one.
+    """
+    if isinstance(samples, array):
+        return samples
+    return array(typecode, samples)
+
+
+def _new_samples(length, like):
+    """
+    Return a buffer of length zeros to hold output samples: an array of the
+    same type as like if like is an array, and a list otherwise.
+    """
+    if isinstance(like, array):
+        return array(like.typecode, bytes(like.itemsize * length))
+    return [0] * length
+
+
+def _like(template, sound):
+    """
+    Given the sound that an effect was applied to and the dictionary the effect
+    produced, return the result in the same representation as the input: as a
+    Sound or StereoSound if the input was one, and as the dictionary otherwise.
+    """
+    if not isinstance(template, Sound):
+        return sound
+    typecode = _typecode(template)
+    if "left" in sound:
+        return StereoSound(sound["rate"], sound["left"], sound["right"], typecode)
+    return Sound(sound["rate"], sound["samples"], typecode)
+
+
+def _typecode(sound):
+    """
+    Return the array typecode used to store the samples of a compact sound.
+    """
+    return (sound.left if isinstance(sound, StereoSound) else sound.samples).typecode
+
+
+# Profiling
+#
+# The effects below are wrapped by _profiled.  While profiling is off (the
+# default) a wrapped effect costs one extra call and a flag check; after
+# enable_profiling() every call records its wall time, the number of samples
+# it processed and (optionally) the peak memory it allocated, per effect and
+# per process, for stats() to report.
+
+_PROFILING = False
+_PROFILE_MEMORY = False
+_PROFILE_STATS = {}
+_PROFILE_LOG = None
+_PROFILE_PEAKS = []
+_STARTED_TRACEMALLOC = False
+
+
+def enable_profiling(memory=True, log_interval=None, log=None):
+    """
+    Start recording statistics for every call to an effect.  If memory is
+    true, tracemalloc is used to measure each call's peak allocation (which
+    slows the calls down considerably).  If log_interval is given, a summary
+    line is passed to log (which writes to stderr by default) after a call
+    whenever at least that many seconds have passed since the last one.
+    """
+    global _PROFILING, _PROFILE_MEMORY, _PROFILE_LOG, _STARTED_TRACEMALLOC
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _STARTED_TRACEMALLOC = True
+    _PROFILE_MEMORY = memory
+    _PROFILE_LOG = None
+    if log_interval is not None:
+        _PROFILE_LOG = [log_interval, time.perf_counter(), log or _log_stderr]
+    _PROFILING = True
+
+
+def disable_profiling():
+    """
+    Stop recording statistics, keeping the ones recorded so far.
+    """
+    global _PROFILING, _PROFILE_MEMORY, _PROFILE_LOG, _STARTED_TRACEMALLOC
+    _PROFILING = False
+    _PROFILE_MEMORY = False
+    _PROFILE_LOG = None
+    if _STARTED_TRACEMALLOC:
+        tracemalloc.stop()
+        _STARTED_TRACEMALLOC = False
+
+
+def reset_stats():
+    """
+    Forget every statistic recorded so far.
+    """
+    _PROFILE_STATS.clear()
+
+
+def stats():
+    """
+    Return a dictionary mapping the name of each effect called while profiling
+    to a dictionary of its calls, total seconds, total samples processed,
+    samples_per_second and peak_bytes (the largest peak allocation of a single
+    call, or None if memory was not measured).  Time spent in an effect
+    includes the effects it calls itself.
+    """
+    out = {}
+    for name, record in _PROFILE_STATS.items():
+        calls, seconds, samples, peak = record
+        out[name] = {
+            "calls": calls,
+            "seconds": seconds,
+            "samples": samples,
+            "samples_per_second": samples / seconds if seconds else None,
+            "peak_bytes": peak,
+        }
+    return out
+
+
+def format_stats(statistics=None):
+    """
+    Return a one-line summary of stats() (or of the given statistics).
+    """
+    if statistics is None:
+        statistics = stats()
+    parts = []
+    for name, record in sorted(statistics.items(), key=lambda item: -item[1]["seconds"]):
+        part = "%s: %d call(s) %.3fs" % (name, record["calls"], record["seconds"])
+        if record["samples_per_second"]:
+            part += " %.0f samples/s" % record["samples_per_second"]
+        if record["peak_bytes"] is not None:
+            part += " peak %.1f MiB" % (record["peak_bytes"] / 2**20)
+        parts.append(part)
+    return "profile: " + ("; ".join(parts) or "no calls")
+
+
+def _log_stderr(line):
+    print(line, file=sys.stderr, flush=True)
+
+
+def _profiled(effect):
+    """
+    Wrap an effect so its calls are recorded while profiling is enabled.
+    """
+    name = effect.__name__
+
+    @functools.wraps(effect)
+    def wrapper(*args, **kwargs):
+        if not _PROFILING:
+            return effect(*args, **kwargs)
+        return _call_profiled(name, effect, args, kwargs)
+
+    return wrapper
+
+
+def _call_profiled(name, effect, args, kwargs):
+    """
+    Call effect(*args, **kwargs) and add its statistics to those of name.
+    """
+    memory = _PROFILE_MEMORY and tracemalloc.is_tracing()
+    if memory:
+        # tracemalloc has a single peak, so the peak an enclosing profiled
+        # call reached so far is set aside on a stack before resetting it
+        base, peak = tracemalloc.get_traced_memory()
+        if _PROFILE_PEAKS:
+            _PROFILE_PEAKS[-1] = max(_PROFILE_PEAKS[-1], peak)
+        tracemalloc.reset_peak()
+        _PROFILE_PEAKS.append(base)
+
+    start = time.perf_counter()
+    try:
+        result = effect(*args, **kwargs)
+    finally:
+        seconds = time.perf_counter() - start
+        callPeak = None
+        if memory:
+            peak = max(tracemalloc.get_traced_memory()[1], _PROFILE_PEAKS.pop())
+            if _PROFILE_PEAKS:
+                _PROFILE_PEAKS[-1] = max(_PROFILE_PEAKS[-1], peak)
+            callPeak = peak - base
+
+    samples = sum(_profile_samples(arg) for arg in itertools.chain(args, kwargs.values()))
+    record = _PROFILE_STATS.setdefault(name, [0, 0.0, 0, None])
+    record[0] += 1
+    record[1] += seconds
+    record[2] += samples or _profile_samples(result)
+    if callPeak is not None:
+        record[3] = callPeak if record[3] is None else max(record[3], callPeak)
+
+    if _PROFILE_LOG is not None:
+        interval, last, log = _PROFILE_LOG
+        now = time.perf_counter()
+        if now - last >= interval:
+            _PROFILE_LOG[1] = now
+            log(format_stats())
+    return result
+
+
+def _profile_samples(value):
+    """
+    Return the number of samples per channel in value if it is a sound (or a
+    list of sounds), and 0 otherwise.
+    """
+    if isinstance(value, list) and value and isinstance(value[0], (dict, Sound)):
+        return sum(_profile_samples(item) for item in value)
+    if not isinstance(value, (dict, Sound)) or "rate" not in value:
+        return 0
+    if "frames" in value:
+        return len(value["frames"]) // value["channels"]
+    return len(value["left"] if "left" in value else value["samples"])
+
+
+@_profiled
 def backwards(sound):
     """
     Given a sound, returns the reversed version of the sound without changing the input sound.
     """
     rate = sound['rate']
     samples = sound['samples']
-    reversedSamples = []
-    for i in range(len(samples)):
-        reversedSamples.append(samples[len(samples)-i-1])
+    reversedSamples = samples[::-1]
+    if isinstance(samples, memoryview):
+        # reversing a view (such as a MultiSound channel) gives another view of
+        # the same storage, so copy it
+        reversedSamples = array(samples.format, reversedSamples)
 
     reversedSound = {
         'rate': rate,
         'samples': reversedSamples
     }
 
-    return reversedSound
+    return _like(sound, reversedSound)
 
 
-def mix(sound1, sound2, p):
+@_profiled
+def mix(sound1, sound2, p, match_rates=False):
     """
     Given two sounds and a mixing ratio, mixes the sounds and returns it without editing the inputs. Mixing two sounds consists of averaging corresponding samples in the two sounds, with the samples being weighted according to the mixing ratio.
+
+    If the sampling rates differ, this returns None, unless match_rates is True, in which case sound2 is first resampled to the rate of sound1.
     """
+    if match_rates:
+        sound2 = _match_rate(sound2, sound1['rate'])
 
     rate1 = sound1['rate']
     samples1 = sound1['samples']
@@ -39,8 +450,6 @@ def mix(sound1, sound2, p):
     if rate1 != rate2:
         return None
     else:
-        mixedSamples = []
-
         if len(samples1) > len(samples2):
             # This piece of code switches samples1 and samples2, so with the rest of the mixing, we can treat samples1 as shorter than samples2.
 
@@ -48,26 +457,329 @@ def mix(sound1, sound2, p):
 
             p = 1 - p
 
+        mixedSamples = _new_samples(len(samples2), sound1['samples'])
+
         for i in range(len(samples1)):
-            mixedSamples.append(samples1[i]*p + samples2[i]*(1-p))
+            mixedSamples[i] = samples1[i]*p + samples2[i]*(1-p)
         for i in range(len(samples1), len(samples2)):
-            mixedSamples.append(samples2[i]*(1-p))
+            mixedSamples[i] = samples2[i]*(1-p)
 
         mixedSound = {
             'rate': rate1,
             'samples': mixedSamples
         }
 
-        return mixedSound
+        return _like(sound1, mixedSound)
+
 
-def convolve(sound, kernel):
+@_profiled
+def mix_many(sounds, weights, match_rates=False):
+    """
+    Given a list of sounds and a list of weights (one per sound), returns the weighted sum of the sounds without editing the inputs. As with mix, sounds shorter than the longest one are treated as silent after they end, so mix_many([sound1, sound2], [p, 1 - p]) equals mix(sound1, sound2, p) up to floating-point rounding (mix swaps its inputs when sound1 is longer, which rounds differently). The sounds must all have the same sampling rate (unless match_rates is True, in which case they are all resampled to the rate of the first sound), and must be all mono or all stereo.
+    """
+    if len(sounds) != len(weights):
+        raise ValueError("mix_many needs one weight per sound (got %d sounds and %d weights)" % (len(sounds), len(weights)))
+    if not sounds:
+        raise ValueError("mix_many needs at least one sound")
+    if match_rates:
+        sounds = [_match_rate(sound, sounds[0]['rate']) for sound in sounds]
+
+    rate = sounds[0]['rate']
+    channels = ['left', 'right'] if 'left' in sounds[0] else ['samples']
+    for index, sound in enumerate(sounds):
+        if sound['rate'] != rate:
+            raise ValueError("can't mix sounds with different sampling rates (sound 0 has rate %r, sound %d has rate %r)" % (rate, index, sound['rate']))
+        if ('left' in sound) != (channels[0] == 'left'):
+            raise ValueError("can't mix mono and stereo sounds (sound %d differs from sound 0)" % index)
+
+    mixedSound = {'rate': rate}
+    for channel in channels:
+        length = max(len(sound[channel]) for sound in sounds)
+        mixedSamples = _new_samples(length, sounds[0][channel])
+        for sound, weight in zip(sounds, weights):
+            samples = sound[channel]
+            segment = mixedSamples[:len(samples)]
+            mixedSamples[:len(samples)] = _like_buffer(
+                segment, [m + s * weight for m, s in zip(segment, samples)]
+            )
+        mixedSound[channel] = mixedSamples
+
+    return _like(sounds[0], mixedSound)
+
+
+# number of input samples on each side of an output sample that resample
+# interpolates from (when the rate goes up)
+RESAMPLE_HALF_WIDTH = 16
+
+
+@_profiled
+def resample(sound, rate, half_width=RESAMPLE_HALF_WIDTH):
+    """
+    Given a sound and a new sampling rate, returns a version of the sound resampled to that rate, without changing the input sound.
+
+    The ratio of the rates is reduced to a fraction up / down, and each output sample is computed by a windowed-sinc interpolation filter (low-pass filtered below the lower of the two Nyquist frequencies) with 2 * half_width taps, or proportionally more when the rate goes down. Output sample m sits at input position m * down / up, so only the up different fractional positions ("phases") ever occur; the filter taps for each phase are computed once per rate ratio and cached.
+    """
+    if rate == sound['rate']:
+        return _like(sound, {key: (sound[key] if key == 'rate' else sound[key][:]) for key in sound.keys()})
+
+    divisor = math.gcd(rate, sound['rate'])
+    up = rate // divisor
+    down = sound['rate'] // divisor
+    width, table = _resample_table(up, down, half_width)
+
+    resampledSound = {'rate': rate}
+    for channel in (['left', 'right'] if 'left' in sound else ['samples']):
+        samples = sound[channel]
+        padded = [0.0] * width + list(samples) + [0.0] * (width + 1)
+        resampledSamples = _new_samples(-(-len(samples) * up // down), samples)
+        position = 0
+        for m in range(len(resampledSamples)):
+            # position = m * down, so the input sample at or before the output is position // up
+            start = position // up
+            resampledSamples[m] = sum(map(operator.mul, table[position % up], padded[start + 1:start + 2 * width + 1]))
+            position += down
+        resampledSound[channel] = resampledSamples
+
+    return _like(sound, resampledSound)
+
+
+@functools.lru_cache(maxsize=32)
+def _resample_table(up, down, half_width):
+    """
+    Return the half width (in input samples) of the interpolation filter that resample uses to change rates by a factor of up / down, along with a tuple holding its taps for each of the up phases.
+
+    The taps for phase p weight the input samples from width - 1 before to width after the output position, at fractional offset p / up past the input sample at or before it.
+    """
+    cutoff = min(1.0, up / down)
+    width = math.ceil(half_width / cutoff)
+    table = []
+    for phase in range(up):
+        fraction = phase / up
+        taps = []
+        for j in range(-width + 1, width + 1):
+            distance = fraction - j
+            x = distance / width
+            window = 0.42 + 0.5 * math.cos(math.pi * x) + 0.08 * math.cos(2 * math.pi * x) if abs(x) < 1 else 0.0
+            taps.append(cutoff * _sinc(cutoff * distance) * window)
+        table.append(tuple(taps))
+    return width, tuple(table)
+
+
+def _sinc(x):
+    """
+    Return the normalized sinc function sin(pi x) / (pi x).
+    """
+    if x == 0:
+        return 1.0
+    return math.sin(math.pi * x) / (math.pi * x)
+
+
+def _match_rate(sound, rate):
+    """
+    Return sound itself if it is already at the given sampling rate, and a resampled copy of it otherwise.
+    """
+    if sound['rate'] == rate:
+        return sound
+    return resample(sound, rate)
+
+
+# convolve switches from the direct loop to the FFT once kernels (or sounds) get
+# bigger than this; below it the FFT bookkeeping costs more than it saves.
+# kernels with few enough nonzero taps skip both and only visit those taps.
+DIRECT_CONVOLVE_MAX_TAPS = 12
+DIRECT_CONVOLVE_MAX_WORK = 50000
+SPARSE_CONVOLVE_MAX_TAPS = 24
+
+
+@_profiled
+def convolve(sound, kernel, method="auto", workers=None):
     """
     Given a sound and a kernel, we return the convolution of the sound and kernel. Here, convolution is defined as convolving the list of sound samples with the kernel.
+
+    The kernel can be a list of taps, or a dictionary mapping offsets to weights for a sparse kernel (so {0: 1, 4410: 0.5} is the same kernel as a list holding 1, then 4409 zeros, then 0.5).
+
+    method picks the algorithm: "direct" is the straightforward O(N*K) loop, "sparse" only visits the nonzero taps of the kernel, "fft" is frequency-domain overlap-add, and "auto" (the default) uses "sparse" for kernels with few nonzero taps and "direct" for tiny sounds, and "fft" otherwise. The FFT results agree with the direct loop to within about 1e-12 * max(|samples|) * sum(|kernel|), which is far below the resolution of a 16-bit WAV file.
+
+    method "parallel" splits the output across a pool of workers processes (os.cpu_count() of them unless workers says otherwise), with the samples, kernel and output in shared memory. Each worker does the same arithmetic in the same order as "direct", so the results are exactly the same.
     """
-    # Essentially, convolution is just polynomial multiplication.
-    samples = sound['samples']
+    convolutedSamples = _convolve_samples(sound['samples'], kernel, method, workers)
+
+    convolutedSound = {
+        'rate': sound['rate'],
+        'samples': convolutedSamples
+    }
+
+    return _like(sound, convolutedSound)
+
+
+def _convolve_samples(samples, kernel, method="auto", workers=None):
+    """
+    Given a list of samples, a kernel, a method and a number of workers (as for convolve), return the list of samples of their convolution.
+    """
+    if method == "parallel":
+        return _convolve_parallel(samples, kernel, workers)
+    length, taps = _kernel_taps(kernel)
+    method = _convolve_method(len(samples), length, len(taps), method)
+    return _convolve_resolved(samples, kernel, length, taps, method)
+
+
+def _convolve_resolved(samples, kernel, length, taps, method, plan=None):
+    """
+    Convolve samples with kernel (whose length and nonzero taps are given) using the given method, which must not be "auto".
+    """
+    if method == "sparse":
+        return _convolve_sparse(samples, taps, length)
+    elif method == "direct":
+        return _convolve_direct(samples, _dense_kernel(kernel, length))
+    elif method == "fft":
+        return _convolve_fft(samples, _dense_kernel(kernel, length), plan)
+    else:
+        raise ValueError("unknown convolution method: %r" % (method,))
+
+
+def _convolve_method(num_samples, num_taps, num_nonzero, method):
+    """
+    Resolve the convolution method "auto" to the method that convolve would use for num_samples samples and a kernel of num_taps taps, num_nonzero of which are nonzero; other methods are returned unchanged.
+    """
+    if method != "auto":
+        return method
+    if num_nonzero <= SPARSE_CONVOLVE_MAX_TAPS:
+        return "sparse"
+    if num_taps <= DIRECT_CONVOLVE_MAX_TAPS or num_samples * num_taps <= DIRECT_CONVOLVE_MAX_WORK:
+        return "direct"
+    return "fft"
+
+
+def _kernel_taps(kernel):
+    """
+    Given a kernel (a list, or a dictionary of offsets to weights), return its length and a list of (offset, weight) pairs for its nonzero taps, in order of offset.
+    """
+    if isinstance(kernel, dict):
+        if any(offset < 0 for offset in kernel):
+            raise ValueError("sparse kernel offsets must not be negative")
+        length = max(kernel) + 1 if kernel else 0
+        return length, sorted((offset, weight) for offset, weight in kernel.items() if weight)
+    return len(kernel), [(offset, weight) for offset, weight in enumerate(kernel) if weight]
+
+
+def _dense_kernel(kernel, length):
+    """
+    Return kernel as a list of length taps, filling in zeros if it is sparse.
+    """
+    if not isinstance(kernel, dict):
+        return kernel
+    dense = [0] * length
+    for offset, weight in kernel.items():
+        dense[offset] = weight
+    return dense
+
 
-    convolutedSamples = [0]*(len(samples) + len(kernel) - 1)
+def _convolve_sparse(samples, taps, length):
+    """
+    Given a list of samples and the (offset, weight) pairs of the nonzero taps of a kernel of the given length, return the list of samples of their convolution, adding in one shifted and scaled copy of the samples per tap.
+    """
+    convolutedSamples = _new_samples(len(samples) + length - 1, samples)
+    for offset, weight in taps:
+        segment = convolutedSamples[offset:offset + len(samples)]
+        convolutedSamples[offset:offset + len(samples)] = _like_buffer(
+            segment, [c + weight * s for c, s in zip(segment, samples)]
+        )
+    return convolutedSamples
+
+
+def _convolve_parallel(samples, kernel, workers=None):
+    """
+    Given a list of samples and a kernel, return the list of samples of their convolution, computed by a pool of worker processes that each fill in one contiguous range of the output.
+    """
+    length, taps = _kernel_taps(kernel)
+    numOutput = len(samples) + length - 1
+    if numOutput <= 0:
+        return []
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # the views have to be released before their buffers can be closed, on
+    # the way out of an error as much as on success
+    buffers = []
+    views = []
+    try:
+        for size in (len(samples), len(taps), len(taps), numOutput):
+            buffers.append(shared_memory.SharedMemory(create=True, size=8 * max(size, 1)))
+        for buffer in buffers:
+            views.append(buffer.buf.cast("d"))
+        sharedSamples, sharedOffsets, sharedWeights, sharedOutput = views
+        sharedSamples[:len(samples)] = array("d", samples)
+        sharedOffsets[:len(taps)] = array("d", [offset for offset, _ in taps])
+        sharedWeights[:len(taps)] = array("d", [weight for _, weight in taps])
+
+        # a few shards per worker keeps them all busy to the end
+        numShards = min(numOutput, 4 * workers)
+        bounds = [numOutput * shard // numShards for shard in range(numShards + 1)]
+        names = [buffer.name for buffer in buffers]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            jobs = [
+                pool.submit(_convolve_shard, names, len(samples), len(taps), lo, hi)
+                for lo, hi in zip(bounds, bounds[1:])
+            ]
+            for job in jobs:
+                job.result()
+
+        return sharedOutput[:numOutput].tolist()
+    finally:
+        for view in views:
+            view.release()
+        for buffer in buffers:
+            buffer.close()
+            buffer.unlink()
+
+
+def _convolve_shard(names, num_samples, num_taps, lo, hi):
+    """
+    Worker for _convolve_parallel: attach to the shared buffers with the given names, and fill in output samples lo through hi - 1, adding up the contributions of the kernel taps in order just as _convolve_direct does.
+    """
+    buffers = []
+    views = []
+    try:
+        for name in names:
+            buffers.append(shared_memory.SharedMemory(name=name))
+        for buffer in buffers:
+            views.append(buffer.buf.cast("d"))
+        samples, offsets, weights, output = views
+        convolutedSamples = [0] * (hi - lo)
+        for tap in range(num_taps):
+            offset = int(offsets[tap])
+            weight = weights[tap]
+            start = max(lo, offset)
+            stop = min(hi, offset + num_samples)
+            if start >= stop:
+                continue
+            segment = convolutedSamples[start - lo:stop - lo]
+            convolutedSamples[start - lo:stop - lo] = [
+                c + weight * s for c, s in zip(segment, samples[start - offset:stop - offset])
+            ]
+        output[lo:hi] = array("d", convolutedSamples)
+    finally:
+        for view in views:
+            view.release()
+        for buffer in buffers:
+            buffer.close()
+
+
+def _like_buffer(buffer, values):
+    """
+    Return the list values converted to the same kind of buffer as buffer (an array of the same type, or a list).
+    """
+    if isinstance(buffer, array):
+        return array(buffer.typecode, values)
+    return values
+
+
+def _convolve_direct(samples, kernel):
+    """
+    Given a list of samples and a kernel, return the list of samples of their convolution, computed directly from the definition.
+    """
+    # Essentially, convolution is just polynomial multiplication.
+    convolutedSamples = _new_samples(len(samples) + len(kernel) - 1, samples)
 
     for i in range(len(samples) + len(kernel) - 1):
         # continuing with the polynomial multiplication concept, this is calculating the coefficient of x^i.
@@ -78,15 +790,613 @@ def convolve(sound, kernel):
 
         convolutedSamples[i] = c
 
+    return convolutedSamples
+
+
+def _convolve_fft(samples, kernel, plan=None):
+    """
+    Given a list of samples and a kernel, return the list of samples of their convolution, computed by overlap-add in the frequency domain.
+
+    The signal is cut into blocks of length L and each block is convolved with the kernel through an FFT of size n = L + len(kernel) - 1. Since the kernel is real, two consecutive blocks are packed into the real and imaginary parts of a single complex FFT, and their results come back out as the real and imaginary parts of the inverse transform.
+
+    plan is the (size, kernel spectrum) pair from _fft_plan; it is computed here if it is not given.
+    """
+    numSamples = len(samples)
+    numTaps = len(kernel)
+    convolutedSamples = [0.0] * (numSamples + numTaps - 1)
+    if numSamples == 0 or numTaps == 0:
+        return convolutedSamples
+
+    size, kernelSpectrum = plan or _fft_plan(numSamples, kernel)
+    blockLength = size - numTaps + 1
+
+    for start, spectrum in _packed_block_spectra(samples, blockLength, numTaps):
+        _overlap_add_pair(convolutedSamples, start, blockLength, spectrum, kernelSpectrum)
+
+    return convolutedSamples
+
+
+def _packed_block_spectra(samples, block_length, num_taps):
+    """
+    Cut samples into blocks of block_length, and for each pair of consecutive blocks yield the index of the first one's start and the FFT (of size block_length + num_taps - 1) of the pair packed into the real and imaginary parts of one complex signal.
+    """
+    for start in range(0, len(samples), 2 * block_length):
+        first = list(samples[start:start + block_length])
+        second = list(samples[start + block_length:start + 2 * block_length])
+        first += [0.0] * (block_length - len(first))
+        second += [0.0] * (block_length - len(second))
+        yield start, _fft(list(map(complex, first, second)) + [0j] * (num_taps - 1))
+
+
+def _overlap_add_pair(output, start, block_length, spectrum, kernel_spectrum):
+    """
+    Given the spectrum of a packed pair of blocks starting at start (from _packed_block_spectra) and the spectrum of a kernel, add the convolution of each block with the kernel into output, in place.
+    """
+    result = _fft([x * h for x, h in zip(spectrum, kernel_spectrum)], inverse=True)
+    _add_into(output, start, [v.real for v in result])
+    _add_into(output, start + block_length, [v.imag for v in result])
+
+
+@_profiled
+def convolve_bank(sound, kernels):
+    """
+    Given a sound and a list of kernels, return a list holding the convolution of the sound with each kernel, in order (each the same as convolve(sound, kernel) up to floating-point error, as for its "fft" method).
+
+    This works like the "fft" method of convolve, packing two blocks of the sound into each transform, except that each pair of blocks is transformed only once and that spectrum is reused for every kernel, so each kernel only costs one spectrum multiply and one inverse transform per pair of blocks.
+    """
+    samples = sound['samples']
+    numSamples = len(samples)
+    dense = []
+    for kernel in kernels:
+        length, _ = _kernel_taps(kernel)
+        dense.append(_dense_kernel(kernel, length))
+
+    numTaps = max([len(kernel) for kernel in dense] + [1])
+    size = _fft_block_size(max(numSamples, 1), numTaps)
+    blockLength = size - numTaps + 1
+    spectra = [_fft([complex(k) for k in kernel] + [0j] * (size - len(kernel))) for kernel in dense]
+
+    outputs = [[0.0] * (numSamples + numTaps - 1) for _ in dense]
+    for start, spectrum in _packed_block_spectra(samples, blockLength, numTaps):
+        for kernelSpectrum, convolutedSamples in zip(spectra, outputs):
+            _overlap_add_pair(convolutedSamples, start, blockLength, spectrum, kernelSpectrum)
+
+    convolutedSounds = []
+    for kernel, convolutedSamples in zip(dense, outputs):
+        convolutedSound = {
+            'rate': sound['rate'],
+            'samples': convolutedSamples[:numSamples + len(kernel) - 1]
+        }
+        convolutedSounds.append(_like(sound, convolutedSound))
+    return convolutedSounds
+
+
+# the size of one step of a 16-bit WAV file, as a sample value
+ONE_LSB = 1 / (2**15 - 1)
+
+
+@_profiled
+def convolve_approx(sound, kernel, max_error=ONE_LSB, method="auto", verify=False, workers=None):
+    """
+    Given a sound and a kernel, return an approximation of convolve(sound, kernel) that differs from it by at most max_error in any sample, along with a dictionary describing the approximation.
+
+    The approximation trims taps off both ends of the kernel, smallest first, for as long as max(|samples|) times the sum of the trimmed taps' magnitudes stays within max_error; that sum bounds how far any output sample can move.  The result is shifted back into place, so it lines up with (and is as long as) the exact convolution.  The default max_error of one 16-bit step means the file written by write_wav differs from the exact one by at most one step per sample.
+
+    method and workers choose how the trimmed kernel is applied, as for convolve.
+
+    The dictionary holds the kernel's length ("taps"), the number of taps kept ("kept_taps") and the offset of the first one ("offset"), the guaranteed "error_bound", and the "estimated_speedup" of convolving with the trimmed kernel.  If verify is true, the exact convolution is computed too, and the dictionary also holds the largest difference actually seen ("realised_error"), the time each convolution took ("seconds" and "exact_seconds") and the measured "speedup".
+    """
+    samples = sound['samples']
+    length, taps = _kernel_taps(kernel)
+    peak = max(map(abs, samples), default=0)
+
+    # drop whichever end tap is smaller until the error budget runs out
+    lo, hi = 0, len(taps)
+    dropped = 0
+    while lo < hi:
+        end = lo if abs(taps[lo][1]) <= abs(taps[hi - 1][1]) else hi - 1
+        if (dropped + abs(taps[end][1])) * peak > max_error:
+            break
+        dropped += abs(taps[end][1])
+        if end == lo:
+            lo += 1
+        else:
+            hi -= 1
+
+    numSamples = len(samples)
+    # as long as convolve's output, even when the sound or the kernel is empty
+    outputLength = max(numSamples + length - 1, 0)
+    if lo < hi:
+        offset, last = taps[lo][0], taps[hi - 1][0]
+        if isinstance(kernel, dict):
+            trimmed = {position - offset: weight for position, weight in taps[lo:hi]}
+        else:
+            trimmed = list(kernel[offset:last + 1])
+        keptTaps = last - offset + 1
+    else:
+        offset, trimmed, keptTaps = 0, [], 0
+
+    start = time.perf_counter()
+    if trimmed:
+        convolutedSamples = list(_convolve_samples(samples, trimmed, method, workers))
+        convolutedSamples = [0.0] * offset + convolutedSamples
+        convolutedSamples += [0.0] * (outputLength - len(convolutedSamples))
+    else:
+        convolutedSamples = [0.0] * outputLength
+    seconds = time.perf_counter() - start
+
+    report = {
+        'taps': length,
+        'kept_taps': keptTaps,
+        'offset': offset,
+        'error_bound': dropped * peak,
+        'estimated_speedup': _convolve_cost(numSamples, length, len(taps), method) / max(_convolve_cost(numSamples, keptTaps, hi - lo, method), 1),
+    }
+    if verify:
+        start = time.perf_counter()
+        exact = _convolve_samples(samples, kernel, method, workers)
+        report['exact_seconds'] = time.perf_counter() - start
+        report['seconds'] = seconds
+        report['speedup'] = report['exact_seconds'] / seconds if seconds else float("inf")
+        report['realised_error'] = max((abs(a - b) for a, b in zip(exact, convolutedSamples)), default=0.0)
+
     convolutedSound = {
         'rate': sound['rate'],
         'samples': convolutedSamples
-    }    
+    }
 
-    return convolutedSound
+    return _like(sound, convolutedSound), report
 
 
+def _convolve_cost(num_samples, num_taps, num_nonzero, method="auto"):
+    """
+    Estimate the number of multiply-adds that convolving num_samples samples with a kernel of num_taps taps (num_nonzero of them nonzero) takes, with the method convolve would pick.
+    """
+    if not num_samples or not num_taps:
+        return 0
+    method = _convolve_method(num_samples, num_taps, num_nonzero, method)
+    if method == "sparse":
+        return num_samples * num_nonzero
+    if method in ("direct", "parallel"):
+        return num_samples * num_taps
+    # overlap-add: one forward and one inverse transform per pair of blocks,
+    # plus the pointwise product
+    size = _fft_block_size(num_samples, num_taps)
+    blocks = -(-num_samples // (2 * (size - num_taps + 1)))
+    return blocks * size * (2 * size.bit_length() + 1)
+
+
+def _fft_plan(num_samples, kernel):
+    """
+    Return the FFT size that _convolve_fft should use to convolve num_samples samples with kernel, along with the spectrum of the kernel at that size.
+    """
+    size = _fft_block_size(num_samples, len(kernel))
+    return size, _fft([complex(k) for k in kernel] + [0j] * (size - len(kernel)))
+
 
+def _add_into(target, offset, values):
+    """
+    Add values elementwise into the list target starting at index offset, ignoring anything that would fall past the end of target.
+    """
+    segment = target[offset:offset + len(values)]
+    target[offset:offset + len(segment)] = [t + v for t, v in zip(segment, values)]
+
+
+def _fft_block_size(num_samples, num_taps):
+    """
+    Pick the FFT size (a power of two) for overlap-add convolution of num_samples samples with a kernel of num_taps taps, minimizing the estimated work per output sample.
+    """
+    largest = 1 << (num_samples + num_taps - 2).bit_length()
+    size = 1 << (num_taps - 1).bit_length()
+    if size == num_taps:
+        size *= 2
+    best, bestCost = size, None
+    while size <= max(largest, best):
+        cost = size * size.bit_length() / (size - num_taps + 1)
+        if bestCost is None or cost < bestCost:
+            best, bestCost = size, cost
+        size *= 2
+    return best
+
+
+_FFT_TABLES = {}
+
+
+def _fft_tables(n):
+    """
+    Return the bit-reversal permutation and the forward and inverse twiddle factors used by _fft for a transform of length n, computing them on first use.
+    """
+    if n not in _FFT_TABLES:
+        bits = n.bit_length() - 1
+        order = [int(format(i, '0%db' % bits)[::-1], 2) for i in range(n)] if bits else [0]
+        twiddles = [cmath.exp(-2j * math.pi * k / n) for k in range(n // 2)]
+        _FFT_TABLES[n] = (order, twiddles, [w.conjugate() for w in twiddles])
+    return _FFT_TABLES[n]
+
+
+def _fft(values, inverse=False):
+    """
+    Given a list of complex numbers whose length is a power of two, return its discrete Fourier transform (or the inverse transform, including the 1/n scaling, if inverse is True).
+    """
+    n = len(values)
+    order, twiddles, inverseTwiddles = _fft_tables(n)
+    out = [values[i] for i in order]
+
+    size = 2
+    while size <= n:
+        half = size // 2
+        factors = (inverseTwiddles if inverse else twiddles)[::n // size]
+
+        if half < n // size:
+            # few butterflies per block: walk each twiddle factor across all of the blocks at once
+            for k in range(half):
+                w = factors[k]
+                tops = out[k::size]
+                bottoms = [v * w for v in out[k + half::size]]
+                out[k::size] = [a + b for a, b in zip(tops, bottoms)]
+                out[k + half::size] = [a - b for a, b in zip(tops, bottoms)]
+        else:
+            # few blocks: do each block's butterflies in one go
+            for start in range(0, n, size):
+                tops = out[start:start + half]
+                bottoms = [v * w for v, w in zip(out[start + half:start + size], factors)]
+                out[start:start + half] = [a + b for a, b in zip(tops, bottoms)]
+                out[start + half:start + size] = [a - b for a, b in zip(tops, bottoms)]
+        size *= 2
+
+    if inverse:
+        out = [v / n for v in out]
+    return out
+
+
+def _fft_in_place(values, inverse=False):
+    """
+    Like _fft, but transform the list values in place, without building any
+    new lists.  This is slower than _fft's slice-at-a-time butterflies, so it
+    is only meant for buffers that are reused from call to call.
+    """
+    n = len(values)
+    order, twiddles, inverseTwiddles = _fft_tables(n)
+    for i, j in enumerate(order):
+        if i < j:
+            values[i], values[j] = values[j], values[i]
+    if inverse:
+        twiddles = inverseTwiddles
+
+    size = 2
+    while size <= n:
+        half = size // 2
+        stride = n // size
+        for start in range(0, n, size):
+            for k in range(half):
+                top = start + k
+                bottom = values[top + half] * twiddles[k * stride]
+                values[top + half] = values[top] - bottom
+                values[top] += bottom
+        size *= 2
+
+    if inverse:
+        for i in range(n):
+            values[i] /= n
+
+
+class PartitionedConvolver:
+    """
+    A low-latency convolver for long kernels, using uniformly partitioned
+    overlap-save.  Blocks of block_size samples go in through process, and each
+    call returns the next block_size samples of the convolution right away;
+    flush returns whatever is left once the input is over.  Concatenating all
+    of the outputs gives the same samples as convolve (up to floating-point
+    error, as for its "fft" method).
+
+    The kernel is cut into partitions of block_size taps whose spectra (at an
+    FFT size of 2 * block_size) are computed once up front, and the spectra of
+    recent input blocks are kept in a frequency-domain delay line.  Each block
+    then costs one forward and one inverse FFT of size 2 * block_size no matter
+    how long the kernel is, plus one spectrum multiply-add per partition.  The
+    delay line is a ring of preallocated spectra, and the FFTs run in place on
+    it and on a preallocated accumulator, so that processing a block builds no
+    new buffers (apart from the list that process returns).
+    """
+
+    def __init__(self, kernel, block_size=256):
+        if block_size <= 0 or block_size & (block_size - 1):
+            raise ValueError("block_size must be a power of two")
+        if not len(kernel):
+            raise ValueError("PartitionedConvolver needs a nonempty kernel")
+        self.block_size = block_size
+        self._numTaps = len(kernel)
+        self._partitions = [
+            _fft([complex(k) for k in kernel[start:start + block_size]]
+                 + [0j] * (2 * block_size - len(kernel[start:start + block_size])))
+            for start in range(0, len(kernel), block_size)
+        ]
+        # spectra of the recent input blocks, newest at index self._newest and
+        # older ones after it (wrapping around)
+        self._history = [[0j] * (2 * block_size) for _ in self._partitions]
+        self._newest = 0
+        self._previous = [0.0] * block_size
+        self._total = [0j] * (2 * block_size)
+        self._leftover = []
+        self._samplesIn = 0
+        self._samplesOut = 0
+        self._finished = False
+
+    def process(self, block):
+        """
+        Given the next block of input samples (block_size of them, except that
+        the final block may be shorter), return the next len(block) samples of
+        output.
+        """
+        output = [0.0] * len(block)
+        self._process_into(block, output)
+        return output
+
+    def _process_into(self, block, out):
+        """
+        Like process, but write the output samples into the start of out.
+        """
+        if self._finished:
+            raise ValueError("no more blocks can be processed after a short block or flush")
+        if len(block) > self.block_size:
+            raise ValueError("blocks can hold at most %d samples" % self.block_size)
+
+        self._step(block)
+        self._samplesIn += len(block)
+        self._samplesOut += len(block)
+        total = self._total
+        size = self.block_size
+        for i in range(len(block)):
+            out[i] = total[size + i].real
+        if len(block) < size:
+            self._finished = True
+            self._leftover = [v.real for v in total[size + len(block):]]
+
+    def flush(self):
+        """
+        Return the remaining len(kernel) - 1 samples of output (the tail of the
+        convolution past the end of the input).
+        """
+        self._finished = True
+        remaining = self._samplesIn + self._numTaps - 1 - self._samplesOut
+        output = self._leftover
+        while len(output) < remaining:
+            self._step([])
+            output = output + [v.real for v in self._total[self.block_size:]]
+        output = output[:max(remaining, 0)]
+        self._leftover = []
+        self._samplesOut += len(output)
+        return output
+
+    def _step(self, block):
+        """
+        Push one block (zero-padded to block_size) through the filter, leaving
+        the block_size samples of output that it completes in the second half
+        of self._total.
+        """
+        size = self.block_size
+        count = len(block)
+        history = self._history
+        previous = self._previous
+
+        # the newest spectrum takes the place of the oldest one in the ring
+        self._newest = newest = (self._newest - 1) % len(history)
+        spectrum = history[newest]
+        for i in range(size):
+            x = block[i] if i < count else 0.0
+            spectrum[i] = previous[i]
+            spectrum[size + i] = x
+            previous[i] = x
+        _fft_in_place(spectrum)
+
+        total = self._total
+        for i in range(2 * size):
+            total[i] = 0j
+        for age, partition in enumerate(self._partitions):
+            past = history[(newest + age) % len(history)]
+            for i in range(2 * size):
+                total[i] += past[i] * partition[i]
+
+        # overlap-save: the first half of the circular convolution is aliased
+        _fft_in_place(total, inverse=True)
+
+
+# Short-time Fourier transform
+#
+# stft cuts a sound into overlapping frames of frame_size samples, hop samples
+# apart, multiplies each by an analysis window and keeps the frame_size // 2 + 1
+# nonnegative-frequency bins of its spectrum.  istft undoes it by weighted
+# overlap-add: each inverse-transformed frame is multiplied by the window again,
+# and every output sample is divided by the sum of the squared window values
+# that landed on it, which reconstructs the input exactly (up to floating-point
+# error) for any window whose squares cover every sample.  The input is padded
+# with frame_size - hop zeros up front so that every real sample is covered by
+# the same number of frames.  Since the frames are real, two are packed into
+# each complex FFT, as _convolve_fft does.
+
+STFT_FRAME_SIZE = 1024
+STFT_HOP = 256
+
+STFT_WINDOWS = {
+    "hann": lambda i, n: 0.5 - 0.5 * math.cos(2 * math.pi * i / n),
+    "hamming": lambda i, n: 0.54 - 0.46 * math.cos(2 * math.pi * i / n),
+    "blackman": lambda i, n: 0.42 - 0.5 * math.cos(2 * math.pi * i / n) + 0.08 * math.cos(4 * math.pi * i / n),
+    "rectangular": lambda i, n: 1.0,
+}
+
+
+@functools.lru_cache(maxsize=32)
+def _stft_plan(frame_size, hop, window):
+    """
+    Return the (periodic) analysis window for frames of frame_size samples,
+    and the reciprocals of the overlapped squared-window sums for each of the
+    hop positions within a hop, computing them (and the FFT tables) on first use.
+    """
+    if frame_size < 2 or frame_size & (frame_size - 1):
+        raise ValueError("frame_size must be a power of two")
+    if not 0 < hop <= frame_size:
+        raise ValueError("hop must be between 1 and frame_size")
+    if window not in STFT_WINDOWS:
+        raise ValueError("unknown window %r (expected one of %s)" % (window, ", ".join(STFT_WINDOWS)))
+
+    weights = tuple(STFT_WINDOWS[window](i, frame_size) for i in range(frame_size))
+    sums = [sum(w * w for w in weights[j::hop]) for j in range(hop)]
+    if min(sums) < 1e-12:
+        raise ValueError("a %s window with hop %d can't reconstruct every sample" % (window, hop))
+    _fft_tables(frame_size)
+    return weights, tuple(1 / s for s in sums)
+
+
+def stft(sound, frame_size=STFT_FRAME_SIZE, hop=STFT_HOP, window="hann"):
+    """
+    Given a sound (mono or stereo), return its short-time Fourier transform: a
+    dictionary like the sound, except that each channel holds a list of frames,
+    each a list of frame_size // 2 + 1 complex bins, and it also records the
+    frame_size, hop, window and length (in samples) needed to invert it.
+    """
+    out = {
+        'rate': sound['rate'],
+        'frame_size': frame_size,
+        'hop': hop,
+        'window': window,
+    }
+    for channel in ("left", "right") if "left" in sound else ("samples",):
+        samples = sound[channel]
+        out['length'] = len(samples)
+        blocks = (samples[i:i + STREAM_BLOCK_SIZE] for i in range(0, len(samples), STREAM_BLOCK_SIZE))
+        out[channel] = list(stft_frames(blocks, frame_size, hop, window))
+    return out
+
+
+def istft(spectrogram):
+    """
+    Given the output of stft (possibly with its bins changed), return the sound
+    it describes.
+    """
+    out = {'rate': spectrogram['rate']}
+    for channel in ("left", "right") if "left" in spectrogram else ("samples",):
+        samples = []
+        for block in istft_frames(
+            spectrogram[channel], spectrogram['frame_size'], spectrogram['hop'],
+            spectrogram['window'], spectrogram['length'],
+        ):
+            samples.extend(block)
+        out[channel] = samples
+    return out
+
+
+def stft_frames(blocks, frame_size=STFT_FRAME_SIZE, hop=STFT_HOP, window="hann"):
+    """
+    Given an iterable of blocks of samples (such as a mono stream's blocks),
+    yield the spectra of its frames as soon as enough samples have arrived,
+    holding on to the unread part of the latest block plus at most two frames'
+    worth of samples.
+    """
+    weights, _ = _stft_plan(frame_size, hop, window)
+    pad = frame_size - hop
+    buffer = [0.0] * pad
+    # the next frame starts at buffer[offset]; the samples before it are only
+    # dropped once they make up half of the buffer, so that a long block is
+    # not shifted down once per frame
+    offset = 0
+    # padded position just past the last real sample, once the input is over
+    end = None
+    start = 0
+    pending = None
+
+    for block in itertools.chain(blocks, [None]):
+        if offset > len(buffer) // 2:
+            del buffer[:offset]
+            offset = 0
+        if block is None:
+            end = start + len(buffer) - offset
+            buffer.extend([0.0] * frame_size)
+        else:
+            buffer.extend(block)
+        while len(buffer) - offset >= frame_size and (end is None or start < end):
+            frame = [x * w for x, w in zip(buffer[offset:offset + frame_size], weights)]
+            offset += hop
+            start += hop
+            if pending is None:
+                pending = frame
+            else:
+                yield from _real_spectra(pending, frame)
+                pending = None
+    if pending is not None:
+        yield _real_spectra(pending, [0.0] * frame_size)[0]
+
+
+def _real_spectra(first, second):
+    """
+    Return the nonnegative-frequency halves of the spectra of two real frames,
+    computed with a single complex FFT.
+    """
+    n = len(first)
+    spectrum = _fft(list(map(complex, first, second)))
+    firstSpectrum = []
+    secondSpectrum = []
+    for k in range(n // 2 + 1):
+        x = spectrum[k]
+        mirror = spectrum[-k].conjugate()
+        firstSpectrum.append((x + mirror) * 0.5)
+        secondSpectrum.append((x - mirror) * -0.5j)
+    return firstSpectrum, secondSpectrum
+
+
+def istft_frames(spectra, frame_size=STFT_FRAME_SIZE, hop=STFT_HOP, window="hann", length=None):
+    """
+    Given an iterable of half spectra (as yielded by stft_frames), yield blocks
+    of the reconstructed samples by weighted overlap-add, hop samples at a
+    time as each frame completes them.  If length is given, stop after that
+    many samples.
+    """
+    weights, norms = _stft_plan(frame_size, hop, window)
+    accumulator = [0.0] * frame_size
+    # the first frame_size - hop output samples are the padding stft added
+    skip = frame_size - hop
+    remaining = length
+
+    spectra = iter(spectra)
+    for first in spectra:
+        second = next(spectra, None)
+        frames = _real_frames(first, second, frame_size)
+        for frame in frames[:1 if second is None else 2]:
+            _add_into(accumulator, 0, [x * w for x, w in zip(frame, weights)])
+            block = [x * norm for x, norm in zip(accumulator[:hop], norms)]
+            del accumulator[:hop]
+            accumulator.extend([0.0] * hop)
+
+            if skip:
+                dropped = min(skip, len(block))
+                skip -= dropped
+                block = block[dropped:]
+            if remaining is not None:
+                block = block[:remaining]
+                remaining -= len(block)
+            if block:
+                yield block
+            if remaining == 0:
+                return
+
+
+def _real_frames(first, second, n):
+    """
+    Given the half spectra of one or two real frames (second may be None),
+    return the two frames, computed with a single inverse complex FFT.
+    """
+    if second is None:
+        second = [0j] * (n // 2 + 1)
+    spectrum = [a + 1j * b for a, b in zip(first, second)]
+    spectrum += [a.conjugate() + 1j * b.conjugate() for a, b in zip(first[n // 2 - 1:0:-1], second[n // 2 - 1:0:-1])]
+    frames = _fft(spectrum, inverse=True)
+    return [v.real for v in frames], [v.imag for v in frames]
+
+
+# number of input samples that echo passes through _echo_blocks at once
+ECHO_BLOCK_SIZE = 1 << 16
+
+
+@_profiled
 def echo(sound, num_echoes, delay, scale):
     """
     Given a sound, return a sound that is an echoed version of the original sound. Specifically, the number of echoes, delay between echoes, and scale of each echo is also inputted.
@@ -95,32 +1405,105 @@ def echo(sound, num_echoes, delay, scale):
 
     samples = sound['samples']
 
-    echoedSamples = [0] * (len(samples) + num_echoes * sample_delay)
-
-    echoScale = 1
-    for echo in range(num_echoes + 1):
-        for i in range(len(samples)):
-            echoedSamples[i + echo * sample_delay] += samples[i] * echoScale
-
-        echoScale *= scale
+    # the output goes straight into a buffer like the input's, and the input is
+    # fed through in blocks, so a compact sound never has all of its samples
+    # held as Python floats at once
+    echoedSamples = _new_samples(len(samples) + num_echoes * sample_delay, samples)
+    blocks = (samples[start:start + ECHO_BLOCK_SIZE] for start in range(0, len(samples), ECHO_BLOCK_SIZE))
+    position = 0
+    for block in _echo_blocks(blocks, num_echoes, sample_delay, scale):
+        echoedSamples[position:position + len(block)] = _like_buffer(echoedSamples, block)
+        position += len(block)
 
     echoedSound = {
         'rate': sound['rate'],
         'samples': echoedSamples
     }
 
-    return echoedSound
+    return _like(sound, echoedSound)
 
-    # echo using convolution. Takes a long time
-    # echoKernel = [0] * (sample_delay * num_echoes + 1)
+    # echo using convolution. With a sparse kernel this only visits the
+    # num_echoes + 1 nonzero taps, so it is as fast as the direct loop.
+    # echoKernel = {}
     # echoScale = 1
-    # for i in range(num_echoes):
-    #     echoKernel[sample_delay*i] = echoScale
+    # for i in range(num_echoes + 1):
+    #     echoKernel[sample_delay*i] = echoKernel.get(sample_delay*i, 0) + echoScale
     #     echoScale *= scale
-    # echoKernel[-1] = echoScale
     # return convolve(sound, echoKernel)
 
 
+def _echo_blocks(blocks, num_echoes, sample_delay, scale):
+    """
+    Given an iterable of blocks of samples, yield the blocks of their echoed version (as computed by echo), followed by a final block holding the num_echoes * sample_delay samples of echo tail.
+
+    Rather than adding in each echo separately, this runs the feedback comb filter
+        y[n] = x[n] + scale * y[n - sample_delay] - scale**(num_echoes + 1) * x[n - (num_echoes + 1) * sample_delay]
+    whose last term cancels each echo after num_echoes repeats, so the whole output takes one pass. The last sample_delay output samples and (num_echoes + 1) * sample_delay input samples are carried from one block to the next. The filter amplifies its own rounding errors when abs(scale) > 1, so then the num_echoes + 1 shifted copies of the input are added up directly instead.
+    """
+    tailLength = num_echoes * sample_delay
+    tail = [[0] * tailLength] if tailLength else []
+
+    if sample_delay == 0:
+        # every echo lands on top of the original, so this is just a gain
+        gain = 0
+        echoScale = 1
+        for echo in range(num_echoes + 1):
+            gain += echoScale
+            echoScale *= scale
+        for block in blocks:
+            yield [s * gain for s in block]
+        return
+
+    if abs(scale) > 1:
+        # the comb filter below feeds its own rounding errors back in, scaled
+        # by scale on every trip round the loop, so for louder echoes it blows
+        # up; add in each echo's shifted copy of the input directly instead
+        echoScales = []
+        echoScale = 1
+        for echo in range(num_echoes + 1):
+            echoScales.append(echoScale)
+            echoScale *= scale
+        inputs = [0] * tailLength
+        for block in itertools.chain(blocks, tail):
+            inputs.extend(block)
+            echoed = [0] * len(block)
+            for echo, echoScale in enumerate(echoScales):
+                start = tailLength - echo * sample_delay
+                echoed = [e + echoScale * s for e, s in zip(echoed, inputs[start:start + len(block)])]
+            yield echoed
+            del inputs[:len(block)]
+        return
+
+    cancelScale = 1
+    for echo in range(num_echoes + 1):
+        cancelScale *= scale
+
+    inputLength = (num_echoes + 1) * sample_delay
+    inputs = [0] * inputLength
+    outputs = [0] * sample_delay
+    for block in itertools.chain(blocks, tail):
+        inputs.extend(block)
+        if sample_delay < 16:
+            # stretches this short aren't worth slicing out
+            for i in range(len(block)):
+                outputs.append(inputs[inputLength + i] + scale * outputs[i] - cancelScale * inputs[i])
+        else:
+            for start in range(0, len(block), sample_delay):
+                # each stretch of sample_delay outputs only depends on earlier stretches
+                outputs.extend([
+                    x + scale * y - cancelScale * old
+                    for x, y, old in zip(
+                        inputs[inputLength + start:inputLength + start + sample_delay],
+                        outputs[start:start + sample_delay],
+                        inputs[start:start + sample_delay],
+                    )
+                ])
+        yield outputs[sample_delay:]
+        del inputs[:len(block)]
+        del outputs[:len(block)]
+
+
+@_profiled
 def pan(sound):
     """
     Given a sound, returns a version of the sound that pans from left to right. That is, all the sound initially comes from the left, and then the audio from the left decreases linearly and the audio from the right increases linearly until all the audio comes from the right.
@@ -129,8 +1512,8 @@ def pan(sound):
     right = sound['right']
     N = len(left)
 
-    panLeft = [0] * N
-    panRight = [0] * N
+    panLeft = _new_samples(N, left)
+    panRight = _new_samples(N, right)
 
     for i in range(N):
         panLeft[i] = left[i] * (1-(i)/(N-1))
@@ -142,9 +1525,10 @@ def pan(sound):
         'right': panRight
     }
 
-    return panSound
+    return _like(sound, panSound)
 
 
+@_profiled
 def remove_vocals(sound):
     """
     Given a sound, returns a version of the sound with vocals removed. This is done by subtracting the right samples from the left samples, as vocals are usually recorded in mono, so the vocals usually get subtracted out through this process.
@@ -152,7 +1536,7 @@ def remove_vocals(sound):
     left = sound['left']
     right = sound['right']
 
-    removedVocalsSamples = [0] * len(left)
+    removedVocalsSamples = _new_samples(len(left), left)
 
     for i in range(len(left)):
         removedVocalsSamples[i] = left[i] - right[i]
@@ -162,7 +1546,460 @@ def remove_vocals(sound):
         'samples': removedVocalsSamples
     }
 
-    return removedVocalsSound
+    return _like(sound, removedVocalsSound)
+
+
+# below are lazy views of sounds.  a view is a sound whose channels are
+# SampleView objects instead of lists: reversing, slicing and applying gain
+# envelopes to a view only records what to do, and nothing is computed until
+# something (write_wav, convolve, ...) reads the samples.  views of views are
+# fused into a single view, so a whole stack of them is evaluated in one pass
+# over the original samples.
+
+
+class SampleView:
+    """
+    A read-only sequence presenting samples from base (a list, array or other
+    sequence of samples) in the order base[start], base[start + step], ...
+    (length of them), each multiplied by a series of gain envelopes.
+
+    Indexing gives one sample and slicing gives a list; the reversed, sliced
+    and scaled methods give new views.
+    """
+
+    def __init__(self, base, start=0, step=1, length=None, gains=()):
+        if length is None:
+            length = len(base)
+        self._base = base
+        self._start = start
+        self._step = step
+        self._length = length
+        # each gain is (envelope, origin, stride): the envelope is a number or
+        # a function of the index i that a sample had in the view it was
+        # applied to, where base[origin + stride * i] is that sample
+        self._gains = tuple(gains)
+
+    @classmethod
+    def of(cls, samples):
+        """
+        Return a view of all of samples, unchanged (or samples itself if it
+        is already a view).
+        """
+        return samples if isinstance(samples, cls) else cls(samples)
+
+    def reversed(self):
+        """
+        Return a view of these samples in reverse order.
+        """
+        return SampleView(
+            self._base,
+            self._start + self._step * (self._length - 1),
+            -self._step,
+            self._length,
+            self._gains,
+        )
+
+    def sliced(self, start=None, stop=None, step=None):
+        """
+        Return a view of these samples sliced as by [start:stop:step].
+        """
+        indices = range(self._length)[start:stop:step]
+        return SampleView(
+            self._base,
+            self._start + self._step * indices.start,
+            self._step * indices.step,
+            len(indices),
+            self._gains,
+        )
+
+    def scaled(self, envelope):
+        """
+        Return a view of these samples multiplied by envelope, which is either
+        a number or a function giving the gain for each index into this view.
+        """
+        return SampleView(
+            self._base,
+            self._start,
+            self._step,
+            self._length,
+            self._gains + ((envelope, self._start, self._step),),
+        )
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            indices = range(self._length)[index]
+            if not indices:
+                return []
+            first = self._start + self._step * indices.start
+            step = self._step * indices.step
+            last = first + step * (len(indices) - 1)
+            stop = last + (1 if step > 0 else -1)
+            values = self._base[first:stop if stop >= 0 else None:step]
+            if not self._gains:
+                return list(values)
+
+            # fold the constant gains together, and evaluate all of the
+            # envelopes for each sample as it goes by
+            constant = 1
+            envelopes = []
+            for envelope, origin, stride in self._gains:
+                if callable(envelope):
+                    envelopes.append((envelope, origin, stride))
+                else:
+                    constant *= envelope
+            out = []
+            position = first
+            for v in values:
+                v *= constant
+                for envelope, origin, stride in envelopes:
+                    v *= envelope((position - origin) // stride)
+                out.append(v)
+                position += step
+            return out
+
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("SampleView index out of range")
+        position = self._start + self._step * index
+        value = self._base[position]
+        for envelope, origin, stride in self._gains:
+            value *= envelope((position - origin) // stride) if callable(envelope) else envelope
+        return value
+
+    def __iter__(self):
+        for start in range(0, self._length, WAV_CHUNK_FRAMES):
+            yield from self[start:start + WAV_CHUNK_FRAMES]
+
+    def __repr__(self):
+        return "SampleView(length=%d)" % self._length
+
+
+def _view_channels(sound, transform):
+    """
+    Return a sound whose channels are transform(SampleView.of(channel)) for
+    each channel of the given sound.
+    """
+    out = {'rate': sound['rate']}
+    for channel in (['left', 'right'] if 'left' in sound else ['samples']):
+        out[channel] = transform(SampleView.of(sound[channel]))
+    return out
+
+
+def reversed_view(sound):
+    """
+    Given a sound, returns a lazy view of the reversed sound (see backwards).
+    """
+    return _view_channels(sound, lambda view: view.reversed())
+
+
+def slice_view(sound, start=None, stop=None):
+    """
+    Given a sound, returns a lazy view of samples start through stop - 1 of
+    it, with start and stop interpreted as for slicing a list.
+    """
+    return _view_channels(sound, lambda view: view.sliced(start, stop))
+
+
+def gain_view(sound, envelope):
+    """
+    Given a sound and an envelope (a number, or a function from a sample's
+    index to its gain), returns a lazy view of the sound with every sample
+    multiplied by its gain.  For a stereo sound, envelope may also be a
+    dictionary with separate envelopes under 'left' and 'right'.
+    """
+    if isinstance(envelope, dict):
+        return {
+            'rate': sound['rate'],
+            'left': SampleView.of(sound['left']).scaled(envelope['left']),
+            'right': SampleView.of(sound['right']).scaled(envelope['right']),
+        }
+    return _view_channels(sound, lambda view: view.scaled(envelope))
+
+
+def linear_envelope(start_gain, end_gain, length):
+    """
+    Returns an envelope (for gain_view) that ramps linearly from start_gain at
+    index 0 to end_gain at index length - 1.
+    """
+    if length < 2:
+        return lambda i: start_gain
+    return lambda i: start_gain + (end_gain - start_gain) * i / (length - 1)
+
+
+def pan_view(sound):
+    """
+    Given a stereo sound, returns a lazy view of it panned from left to right
+    (see pan).
+    """
+    N = len(sound['left'])
+    return gain_view(sound, {
+        'left': linear_envelope(1, 0, N),
+        'right': linear_envelope(0, 1, N),
+    })
+
+
+def materialize(sound):
+    """
+    Given a sound (possibly a lazy view), returns a sound with the same
+    samples held in plain lists.
+    """
+    return _like(sound, {
+        key: (sound[key] if key == 'rate' else list(sound[key])) for key in sound.keys()
+    })
+
+
+# below is the fused per-sample engine.  per-sample effects like pan and
+# remove_vocals are written as expressions over the channels of a sound (built
+# from LEFT, RIGHT, SAMPLES, RAMP and numbers with +, - and *), and a chain of
+# them is combined into one expression per output channel, which is then
+# evaluated for every frame in a single loop instead of one loop per effect.
+
+
+class Signal:
+    """
+    A node in a per-sample expression: a channel of the input sound, the
+    position within it (RAMP, which goes from 0 to 1), the samples of an extra
+    input sound (input_signal), a constant, or arithmetic on other Signals.
+    """
+
+    def __init__(self, op, *args):
+        self.op = op
+        self.args = args
+
+    def __add__(self, other):
+        return Signal("+", self, _signal(other))
+
+    def __radd__(self, other):
+        return Signal("+", _signal(other), self)
+
+    def __sub__(self, other):
+        return Signal("-", self, _signal(other))
+
+    def __rsub__(self, other):
+        return Signal("-", _signal(other), self)
+
+    def __mul__(self, other):
+        return Signal("*", self, _signal(other))
+
+    def __rmul__(self, other):
+        return Signal("*", _signal(other), self)
+
+    def __neg__(self):
+        return Signal("*", _signal(-1), self)
+
+    def substitute(self, channels):
+        """
+        Return this expression with each channel leaf replaced by the
+        expression for that channel in the dictionary channels.
+        """
+        if self.op == "channel":
+            return channels[self.args[0]]
+        if self.op in ("+", "-", "*"):
+            return Signal(self.op, *(arg.substitute(channels) for arg in self.args))
+        return self
+
+    def source(self, constants=None):
+        """
+        Return this expression as Python source code over the loop variables
+        of _fused_kernel.  Constants are appended to the list constants and
+        referred to by name (c0, c1, ...), since not every number's repr is
+        valid code (Fraction(1, 3), inf); without a list they are written out
+        with repr, for display only.
+        """
+        if self.op == "const":
+            if constants is None:
+                return repr(self.args[0])
+            constants.append(self.args[0])
+            return "c%d" % (len(constants) - 1)
+        if self.op == "channel":
+            return {"left": "l", "right": "r", "samples": "l"}[self.args[0]]
+        if self.op == "ramp":
+            return "(i / d)"
+        if self.op == "input":
+            return "x%d" % self.args[0]
+        return "(%s %s %s)" % (self.args[0].source(constants), self.op, self.args[1].source(constants))
+
+    def __repr__(self):
+        return "Signal(%s)" % self.source()
+
+
+def _signal(value):
+    """
+    Return value as a Signal, wrapping numbers as constants.
+    """
+    return value if isinstance(value, Signal) else Signal("const", value)
+
+
+def input_signal(index):
+    """
+    Return the Signal for the samples of the extra input sound at the given
+    index (see fused).
+    """
+    return Signal("input", index)
+
+
+LEFT = Signal("channel", "left")
+RIGHT = Signal("channel", "right")
+SAMPLES = Signal("channel", "samples")
+RAMP = Signal("ramp")
+
+# the per-sample effects as stages: dictionaries from output channel names to
+# expressions over the channels of their input
+PAN = {"left": LEFT * (1 - RAMP), "right": RIGHT * RAMP}
+REMOVE_VOCALS = {"samples": LEFT - RIGHT}
+
+
+def mix_stage(p, index=0):
+    """
+    Return the stage that mixes a mono sound with the extra input sound at the
+    given index, with mixing ratio p (see mix).
+    """
+    return {"samples": SAMPLES * p + input_signal(index) * (1 - p)}
+
+
+def chain_stages(*stages):
+    """
+    Combine stages, applied in the given order, into a single stage.
+    """
+    combined = stages[0]
+    for stage in stages[1:]:
+        combined = {channel: expr.substitute(combined) for channel, expr in stage.items()}
+    return combined
+
+
+@_profiled
+def fused(sound, stage, inputs=()):
+    """
+    Given a sound, a stage (a dictionary from output channel names to
+    expressions, as from chain_stages) and a list of extra mono input sounds,
+    evaluate the stage for every frame of the sound in one loop and return the
+    resulting sound.  As with mix, the output is as long as the longest input,
+    with shorter inputs treated as silent after they end.  RAMP goes from 0 at
+    the first sample of sound to 1 at its last.
+
+    sound may also be an interleaved buffer (see interleave), in which case the
+    loop runs over its frames directly, and a stereo result is written into a
+    new interleaved buffer.
+    """
+    if set(stage) not in ({"samples"}, {"left", "right"}):
+        raise ValueError("a stage must have either a 'samples' expression or 'left' and 'right' ones (got %s)" % ", ".join(map(repr, sorted(stage))))
+    for extra in inputs:
+        if extra["rate"] != sound["rate"]:
+            raise ValueError("can't combine sounds with different sampling rates")
+
+    channels = sorted(stage)
+    constants = []
+    sources = tuple(stage[channel].source(constants) for channel in channels)
+    extras = [extra["samples"] for extra in inputs]
+
+    if "frames" in sound:
+        numFrames = len(sound["frames"]) // 2
+        length = max([numFrames] + [len(samples) for samples in extras])
+        kernel = _fused_interleaved_kernel(sources, len(inputs), len(constants))
+        if channels == ["samples"]:
+            samples = [0.0] * length
+            kernel(sound["frames"], extras, length, max(numFrames - 1, 1), constants, samples)
+            return {"rate": sound["rate"], "samples": samples}
+        frames = array("d", bytes(16 * length))
+        kernel(sound["frames"], extras, length, max(numFrames - 1, 1), constants, frames)
+        return {"rate": sound["rate"], "channels": 2, "frames": frames}
+
+    if "left" in sound:
+        left = sound["left"]
+        right = sound["right"]
+    else:
+        left = right = sound["samples"]
+    kernel = _fused_kernel(sources, len(inputs), len(constants))
+    results = kernel(left, right, extras, max(len(left) - 1, 1), constants)
+
+    if channels == ["samples"]:
+        return _like(sound, {"rate": sound["rate"], "samples": results})
+    return _like(sound, {"rate": sound["rate"], "left": list(results[0]), "right": list(results[1])})
+
+
+@functools.lru_cache(maxsize=64)
+def _fused_kernel(sources, num_inputs, num_constants):
+    """
+    Compile a loop that evaluates the expressions with the given sources for
+    every frame: it takes the left and right samples, the extra inputs, the
+    divisor for RAMP and the list of constants (c0, c1, ...), and returns a
+    list of samples for a single expression, or a tuple of the left and right
+    output channels for two.  The constants are passed in rather than written
+    into the code, so stages that differ only in them share a kernel.
+    """
+    names = "".join(", x%d" % k for k in range(num_inputs))
+    if len(sources) == 1:
+        body = "[%s for i, (l, r%s) in enumerate(frames)]" % (sources[0], names)
+    else:
+        body = "tuple(zip(*[(%s, %s) for i, (l, r%s) in enumerate(frames)])) or ((), ())" % (
+            sources[0], sources[1], names
+        )
+    code = "def kernel(left, right, inputs, d, constants):\n"
+    if num_constants:
+        code += "    %s, = constants\n" % ", ".join("c%d" % k for k in range(num_constants))
+    code += (
+        "    frames = zip_longest(left, right, *inputs, fillvalue=0)\n"
+        "    return %s\n" % body
+    )
+    namespace = {"zip_longest": itertools.zip_longest}
+    exec(code, namespace)
+    return namespace["kernel"]
+
+
+@functools.lru_cache(maxsize=64)
+def _fused_interleaved_kernel(sources, num_inputs, num_constants):
+    """
+    Like _fused_kernel, but compile a loop that reads the left and right
+    samples straight from an interleaved buffer of frames.  It takes the
+    frames, the extra inputs, the number of output frames, the divisor for
+    RAMP, the constants and an output buffer, and writes the results into the
+    output buffer: one sample per frame for a single expression, or
+    interleaved left and right samples for two.
+    """
+    names = "".join("x%d, " % k for k in range(num_inputs))
+    code = "def kernel(frames, inputs, length, d, constants, out):\n"
+    if num_constants:
+        code += "    %s, = constants\n" % ", ".join("c%d" % k for k in range(num_constants))
+    # the frames are read in (left, right) pairs off a single iterator, and
+    # every input is padded with silence out to length
+    code += "    samples = iter(frames)\n"
+    code += "    rows = zip(range(length), chain(zip(samples, samples), repeat((0, 0)))"
+    if num_inputs:
+        code += ", chain(zip_longest(*inputs, fillvalue=0), repeat((0,) * %d))" % num_inputs
+    code += ")\n"
+    code += "    for i, (l, r)%s in rows:\n" % (", (%s)" % names if num_inputs else "")
+    if len(sources) == 1:
+        code += "        out[i] = %s\n" % sources[0]
+    else:
+        code += "        out[2 * i] = %s\n" % sources[0]
+        code += "        out[2 * i + 1] = %s\n" % sources[1]
+    namespace = {"zip_longest": itertools.zip_longest, "chain": itertools.chain, "repeat": itertools.repeat}
+    exec(code, namespace)
+    return namespace["kernel"]
+
+
+def interleave(sound):
+    """
+    Given a stereo sound, return it as a compact interleaved buffer: a
+    dictionary with its 'rate', 'channels' (2) and 'frames', an array of
+    doubles holding left, right, left, right, ...
+    """
+    frames = array("d", bytes(16 * len(sound["left"])))
+    frames[0::2] = _as_array(sound["left"], "d")
+    frames[1::2] = _as_array(sound["right"], "d")
+    return {"rate": sound["rate"], "channels": 2, "frames": frames}
+
+
+def deinterleave(sound):
+    """
+    Given an interleaved buffer (see interleave), return the stereo sound it
+    holds, with its channels in arrays.
+    """
+    return StereoSound(sound["rate"], sound["frames"][0::2], sound["frames"][1::2])
 
 
 def bass_boost_kernel(n_val, scale=0):
@@ -173,13 +2010,32 @@ def bass_boost_kernel(n_val, scale=0):
     (1/2 + 1/2cos(Omega)) ^ n_val
 
     Then we scale that piece up and add a copy of the original signal back in.
+
+    Kernels are cached, so asking for the same (n_val, scale) again is cheap;
+    each call still returns a fresh list that the caller is free to modify.
     """
-    # make this a fake "sound" so that we can use the convolve function
-    base = {"rate": 0, "samples": [0.25, 0.5, 0.25]}
-    kernel = {"rate": 0, "samples": [0.25, 0.5, 0.25]}
-    for i in range(n_val):
-        kernel = convolve(kernel, base["samples"])
-    kernel = kernel["samples"]
+    return list(_bass_boost_kernel(n_val, scale))
+
+
+@functools.lru_cache(maxsize=64)
+def _bass_boost_kernel(n_val, scale):
+    """
+    Compute bass_boost_kernel(n_val, scale) as a tuple.
+    """
+    # the low-pass filter is [0.25, 0.5, 0.25] convolved with itself n_val
+    # times, i.e. the coefficients of ((1 + x) / 2) ** (2 * half), so its taps
+    # are C(2 * half, k) / 4 ** half.  we start from the central (largest) tap
+    # and recur outward with ratios of consecutive binomial coefficients, in
+    # floats, so the whole kernel takes O(n_val) time and nothing overflows
+    # (the outermost taps underflow to zero for large n_val, as they should).
+    half = n_val + 1
+    center = 1.0
+    for k in range(1, half + 1):
+        center *= (2 * k - 1) / (2 * k)
+    right = [center]
+    for k in range(half, 2 * half):
+        right.append(right[-1] * (2 * half - k) / (k + 1))
+    kernel = right[:0:-1] + right
 
     # at this point, the kernel will be acting as a low-pass filter, so we
     # scale up the values by the given scale, and add in a value in the middle
@@ -187,83 +2043,803 @@ def bass_boost_kernel(n_val, scale=0):
     kernel = [i * scale for i in kernel]
     kernel[len(kernel) // 2] += 1
 
-    return kernel
+    return tuple(kernel)
 
 
 # below are helper functions for converting back-and-forth between WAV files
 # and our internal dictionary representation for sounds
 
 
-def load_wav(filename, stereo=False):
+# number of frames that load_wav and write_wav move to or from the file at once
+WAV_CHUNK_FRAMES = 1 << 16
+
+
+@_profiled
+def load_wav(filename, stereo=False, compact=False, multichannel=False):
     """
     Given the filename of a WAV file, load the data from that file and return a
     Python dictionary representing that sound
+
+    If compact is True, return a Sound or StereoSound (storing C doubles)
+    instead of a dictionary; compact may also be "f" to store C floats.
+
+    If multichannel is True, return a MultiSound holding every channel of the
+    file (stored as C floats if compact is "f").  Otherwise, files with more
+    than two channels are averaged down to mono, or reduced to their first two
+    (front left and right) channels for stereo.
     """
     file = wave.open(filename, "r")
-    chan, bd, sr, count, _, _ = file.getparams()
+    chan, bd, sr, _, _, _ = file.getparams()
 
     assert bd == 2, "only 16-bit WAV files are supported"
 
     out = {"rate": sr}
+    typecode = "d" if compact in (True, False) else compact
 
-    if stereo:
-        left = []
-        right = []
-        for i in range(count):
-            frame = file.readframes(1)
-            if chan == 2:
-                left.append(struct.unpack("<h", frame[:2])[0])
-                right.append(struct.unpack("<h", frame[2:])[0])
-            else:
-                datum = struct.unpack("<h", frame)[0]
-                left.append(datum)
-                right.append(datum)
+    if multichannel:
+        channels = [array(typecode) for _ in range(chan)]
+        for data in _read_wav_chunks(file, chan):
+            for channel, samples in enumerate(channels):
+                samples.extend([i / (2**15) for i in data[channel::chan]])
+        file.close()
+        return MultiSound(sr, channels, typecode)
 
-        out["left"] = [i / (2**15) for i in left]
-        out["right"] = [i / (2**15) for i in right]
+    if stereo:
+        left = array(typecode) if compact else []
+        right = array(typecode) if compact else []
+        for data in _read_wav_chunks(file, chan):
+            leftChunk, rightChunk = _decode_chunk(data, chan, stereo)
+            left.extend(leftChunk)
+            right.extend(rightChunk)
+
+        out["left"] = left
+        out["right"] = right
     else:
-        samples = []
-        for i in range(count):
-            frame = file.readframes(1)
-            if chan == 2:
-                left = struct.unpack("<h", frame[:2])[0]
-                right = struct.unpack("<h", frame[2:])[0]
-                samples.append((left + right) / 2)
-            else:
-                datum = struct.unpack("<h", frame)[0]
-                samples.append(datum)
+        samples = array(typecode) if compact else []
+        for data in _read_wav_chunks(file, chan):
+            samples.extend(_decode_chunk(data, chan, stereo))
 
-        out["samples"] = [i / (2**15) for i in samples]
+        out["samples"] = samples
 
+    file.close()
+    if compact:
+        if stereo:
+            return StereoSound(sr, out["left"], out["right"])
+        return Sound(sr, out["samples"])
     return out
 
 
+def _read_wav_chunks(file, chan, frames=WAV_CHUNK_FRAMES):
+    """
+    Given an open 16-bit WAV file with chan channels, yield its interleaved
+    samples as arrays of signed integers, the given number of frames at a time
+    """
+    while True:
+        chunk = file.readframes(frames)
+        if not chunk:
+            return
+        data = array("h")
+        data.frombytes(chunk[:len(chunk) - len(chunk) % (2 * chan)])
+        if sys.byteorder == "big":
+            data.byteswap()
+        yield data
+
+
+def _decode_chunk(data, chan, stereo):
+    """
+    Given an array of interleaved 16-bit samples from a WAV file with chan
+    channels, return them scaled to floats: as a (left, right) pair of lists if
+    stereo is True (the first two channels, when there are more), and as a
+    single list of samples (averaged over the channels) otherwise
+    """
+    if stereo:
+        if chan >= 2:
+            return [i / (2**15) for i in data[0::chan]], [i / (2**15) for i in data[1::chan]]
+        converted = [i / (2**15) for i in data]
+        return converted, converted
+    if chan == 2:
+        return [(l + r) / 2 / (2**15) for l, r in zip(data[0::2], data[1::2])]
+    if chan > 2:
+        return [sum(frame) / chan / (2**15) for frame in zip(*(data[c::chan] for c in range(chan)))]
+    return [i / (2**15) for i in data]
+
+
+def map_wav(filename, stereo=False):
+    """
+    Given the filename of a WAV file, return a Python dictionary representing
+    that sound, just like load_wav, except that the sample lists are WavChannel
+    objects that decode samples from the memory-mapped file only when they are
+    read, instead of lists of every sample in the file
+    """
+    with open(filename, "rb") as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    chan, sr, start, size = _parse_wav_header(mapped)
+    data = memoryview(mapped)[start:start + size - size % (2 * chan)]
+    if sys.byteorder == "big":
+        # WAV data is little-endian, so it has to be swapped into memory here
+        swapped = array("h", data)
+        swapped.byteswap()
+        data = memoryview(swapped)
+    else:
+        data = data.cast("h")
+
+    out = {"rate": sr}
+    if stereo:
+        out["left"] = WavChannel(data, chan, 0)
+        out["right"] = WavChannel(data, chan, 1 if chan >= 2 else 0)
+    else:
+        out["samples"] = WavChannel(data, chan, None if chan >= 2 else 0)
+    return out
+
+
+def _parse_wav_header(data):
+    """
+    Given the raw bytes of a WAV file, check that it holds 16-bit PCM audio
+    and return its number of channels, its sampling rate, and the offset and
+    length in bytes of its data chunk
+    """
+    assert data[0:4] == b"RIFF" and data[8:12] == b"WAVE", "not a WAV file"
+    chan = sr = None
+    pos = 12
+    while pos + 8 <= len(data):
+        chunkId = data[pos:pos + 4]
+        chunkSize = int.from_bytes(data[pos + 4:pos + 8], "little")
+        pos += 8
+        if chunkId == b"fmt ":
+            fmt = int.from_bytes(data[pos:pos + 2], "little")
+            chan = int.from_bytes(data[pos + 2:pos + 4], "little")
+            sr = int.from_bytes(data[pos + 4:pos + 8], "little")
+            bd = int.from_bytes(data[pos + 14:pos + 16], "little")
+            assert fmt == 1 and bd == 16, "only 16-bit WAV files are supported"
+        elif chunkId == b"data":
+            assert chan is not None, "WAV data chunk comes before its format"
+            return chan, sr, pos, min(chunkSize, len(data) - pos)
+        pos += chunkSize + chunkSize % 2
+    raise ValueError("WAV file has no data chunk")
+
+
+class WavChannel:
+    """
+    A read-only sequence holding one channel of a memory-mapped 16-bit WAV
+    file (or, for a file with several channels read as mono, their average),
+    scaled to floats the same way as load_wav.  Indexing gives a float and
+    slicing gives a list; nothing is decoded until it is asked for.
+    """
+
+    def __init__(self, data, chan, which):
+        self._data = data
+        self._chan = chan
+        self._which = which
+        self._length = len(data) // chan
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            frames = range(self._length)[index]
+            if not frames:
+                return []
+            if self._which is None:
+                return [
+                    sum(frame) / self._chan / (2**15)
+                    for frame in zip(*(self._raw(frames, c) for c in range(self._chan)))
+                ]
+            return [i / (2**15) for i in self._raw(frames, self._which)]
+
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("WavChannel index out of range")
+        pos = index * self._chan
+        if self._which is None:
+            return sum(self._data[pos:pos + self._chan]) / self._chan / (2**15)
+        return self._data[pos + self._which] / (2**15)
+
+    def __iter__(self):
+        for start in range(0, self._length, WAV_CHUNK_FRAMES):
+            yield from self[start:start + WAV_CHUNK_FRAMES]
+
+    def __repr__(self):
+        return "WavChannel(length=%d)" % self._length
+
+    def _raw(self, frames, which):
+        """
+        Given a nonempty range of frame numbers, return the raw integer
+        samples of channel which in those frames
+        """
+        first = frames[0] * self._chan + which
+        stop = frames[-1] * self._chan + which + (1 if frames.step > 0 else -1)
+        return self._data[first:stop if stop >= 0 else None:frames.step * self._chan].tolist()
+
+
+@_profiled
 def write_wav(sound, filename):
     """
     Given a dictionary representing a sound, and a filename, convert the given
     sound into WAV format and save it as a file with the given filename (which
-    can then be opened by most audio players)
+    can then be opened by most audio players).  A MultiSound is written with
+    all of its channels.
     """
     outfile = wave.open(filename, "w")
 
-    if "samples" in sound:
+    if isinstance(sound, MultiSound):
+        # any number of channels, interleaved frame by frame
+        outfile.setparams((sound.num_channels, 2, sound.rate, 0, "NONE", "not compressed"))
+        channels = sound.channels()
+        for start in range(0, sound.length, WAV_CHUNK_FRAMES):
+            out = _encode_interleaved([channel[start:start + WAV_CHUNK_FRAMES] for channel in channels])
+            outfile.writeframes(out.tobytes())
+    elif "samples" in sound:
         # mono file
         outfile.setparams((1, 2, sound["rate"], 0, "NONE", "not compressed"))
-        out = [int(max(-1, min(1, v)) * (2**15 - 1)) for v in sound["samples"]]
+        samples = sound["samples"]
+        for start in range(0, len(samples), WAV_CHUNK_FRAMES):
+            out = _encode_samples(samples[start:start + WAV_CHUNK_FRAMES])
+            outfile.writeframes(out.tobytes())
     else:
         # stereo
         outfile.setparams((2, 2, sound["rate"], 0, "NONE", "not compressed"))
-        out = []
-        for left, right in zip(sound["left"], sound["right"]):
-            left = int(max(-1, min(1, left)) * (2**15 - 1))
-            right = int(max(-1, min(1, right)) * (2**15 - 1))
-            out.append(left)
-            out.append(right)
-
-    outfile.writeframes(b"".join(struct.pack("<h", frame) for frame in out))
+        left = sound["left"]
+        right = sound["right"]
+        # like zip, stop at the end of the shorter channel
+        for start in range(0, min(len(left), len(right)), WAV_CHUNK_FRAMES):
+            out = _encode_stereo(
+                left[start:start + WAV_CHUNK_FRAMES], right[start:start + WAV_CHUNK_FRAMES]
+            )
+            outfile.writeframes(out.tobytes())
+
     outfile.close()
 
 
+def _encode_samples(samples):
+    """
+    Given a chunk of samples, clip them to [-1, 1] and return them as an array
+    of little-endian 16-bit integers, ready to be written to a WAV file
+    """
+    out = array("h", [int(max(-1, min(1, v)) * (2**15 - 1)) for v in samples])
+    if sys.byteorder == "big":
+        out.byteswap()
+    return out
+
+
+def _encode_stereo(left, right):
+    """
+    Given chunks of left and right samples, return them encoded as for
+    _encode_samples and interleaved into stereo frames
+    """
+    return _encode_interleaved([left, right])
+
+
+def _encode_interleaved(channels):
+    """
+    Given chunks of samples for each channel, return them encoded as for
+    _encode_samples and interleaved into frames, stopping at the end of the
+    shortest chunk
+    """
+    encoded = [_encode_samples(channel) for channel in channels]
+    length = min(len(chunk) for chunk in encoded)
+    out = array("h", bytes(2 * len(channels) * length))
+    for index, chunk in enumerate(encoded):
+        out[index::len(channels)] = chunk[:length]
+    return out
+
+
+# below are the stages of the streaming pipeline.  a stream is a dictionary like
+# a sound, except that instead of its samples it holds an iterator of blocks of
+# samples under 'blocks' (each block is a list for a mono stream, or a
+# (left, right) pair of lists if 'stereo' is True), plus its total number of
+# samples under 'length' when that is known in advance.  each stage consumes
+# the blocks of its input stream as it yields its own, so a chain of stages
+# only ever holds a few blocks in memory at once.
+
+STREAM_BLOCK_SIZE = 4096
+
+
+def stream_wav(filename, stereo=False, block_size=STREAM_BLOCK_SIZE):
+    """
+    Given the filename of a WAV file, return a stream of its samples, read from
+    the file block_size frames at a time as the stream is consumed
+    """
+    file = wave.open(filename, "r")
+    chan, bd, sr, count, _, _ = file.getparams()
+
+    assert bd == 2, "only 16-bit WAV files are supported"
+
+    def blocks():
+        try:
+            for data in _read_wav_chunks(file, chan, block_size):
+                yield _decode_chunk(data, chan, stereo)
+        finally:
+            file.close()
+
+    return {"rate": sr, "blocks": blocks(), "length": count, "stereo": stereo}
+
+
+def stream_sound(sound, block_size=STREAM_BLOCK_SIZE):
+    """
+    Given a sound, return a stream of its samples in blocks of block_size
+    """
+    if "samples" in sound:
+        samples = sound["samples"]
+        blocks = (
+            list(samples[start:start + block_size])
+            for start in range(0, len(samples), block_size)
+        )
+        return {"rate": sound["rate"], "blocks": blocks, "length": len(samples), "stereo": False}
+
+    left = sound["left"]
+    right = sound["right"]
+    blocks = (
+        (list(left[start:start + block_size]), list(right[start:start + block_size]))
+        for start in range(0, len(left), block_size)
+    )
+    return {"rate": sound["rate"], "blocks": blocks, "length": len(left), "stereo": True}
+
+
+def collect_stream(stream):
+    """
+    Given a stream, consume it and return the sound it represents
+    """
+    if stream.get("stereo"):
+        left = []
+        right = []
+        for leftBlock, rightBlock in stream["blocks"]:
+            left.extend(leftBlock)
+            right.extend(rightBlock)
+        return {"rate": stream["rate"], "left": left, "right": right}
+
+    samples = []
+    for block in stream["blocks"]:
+        samples.extend(block)
+    return {"rate": stream["rate"], "samples": samples}
+
+
+def write_wav_stream(stream, filename):
+    """
+    Given a stream and a filename, consume the stream and write it to a WAV
+    file block by block, as write_wav does for a whole sound
+    """
+    outfile = wave.open(filename, "w")
+    stereo = stream.get("stereo", False)
+    outfile.setparams((2 if stereo else 1, 2, stream["rate"], 0, "NONE", "not compressed"))
+
+    for block in stream["blocks"]:
+        if stereo:
+            outfile.writeframes(_encode_stereo(*block).tobytes())
+        else:
+            outfile.writeframes(_encode_samples(block).tobytes())
+
+    outfile.close()
+
+
+def _derived_stream(stream, blocks, extra_length=0, stereo=None):
+    """
+    Return a new stream holding the given blocks, with the same rate as stream
+    and a length extra_length longer than it (if its length is known)
+    """
+    out = {
+        "rate": stream["rate"],
+        "blocks": blocks,
+        "stereo": stream.get("stereo", False) if stereo is None else stereo,
+    }
+    if stream.get("length") is not None:
+        out["length"] = stream["length"] + extra_length
+    return out
+
+
+def _mono_blocks(stream):
+    """
+    Given a stream, check that it is mono and return its iterator of blocks
+    """
+    if stream.get("stereo"):
+        raise ValueError("this stage needs a mono stream")
+    return stream["blocks"]
+
+
+def _stereo_blocks(stream):
+    """
+    Given a stream, check that it is stereo and return its iterator of blocks
+    """
+    if not stream.get("stereo"):
+        raise ValueError("this stage needs a stereo stream")
+    return stream["blocks"]
+
+
+def _reblock(blocks, block_size):
+    """
+    Given an iterator of mono blocks of any sizes, yield the same samples in
+    blocks of exactly block_size samples (except possibly the last one)
+    """
+    pending = []
+    for block in blocks:
+        pending.extend(block)
+        while len(pending) >= block_size:
+            yield pending[:block_size]
+            del pending[:block_size]
+    if pending:
+        yield pending
+
+
+def stream_echo(stream, num_echoes, delay, scale):
+    """
+    Streaming version of echo: given a mono stream, return a stream of its
+    echoed version, which is num_echoes * sample_delay samples longer
+    """
+    sample_delay = round(delay * stream["rate"])
+    blocks = _echo_blocks(_mono_blocks(stream), num_echoes, sample_delay, scale)
+    return _derived_stream(stream, blocks, num_echoes * sample_delay)
+
+
+def stream_mix(stream1, stream2, p):
+    """
+    Streaming version of mix: given two mono streams with the same sampling
+    rate and a mixing ratio, return a stream of their mix (or None if the
+    sampling rates differ, just like mix)
+    """
+    if stream1["rate"] != stream2["rate"]:
+        return None
+
+    def blocks():
+        pairs = itertools.zip_longest(
+            _reblock(_mono_blocks(stream1), STREAM_BLOCK_SIZE),
+            _reblock(_mono_blocks(stream2), STREAM_BLOCK_SIZE),
+            fillvalue=[],
+        )
+        for block1, block2 in pairs:
+            if len(block1) < len(block2):
+                block1 = block1 + [0] * (len(block2) - len(block1))
+            elif len(block2) < len(block1):
+                block2 = block2 + [0] * (len(block1) - len(block2))
+            yield [s1 * p + s2 * (1 - p) for s1, s2 in zip(block1, block2)]
+
+    out = _derived_stream(stream1, blocks())
+    if stream1.get("length") is None or stream2.get("length") is None:
+        out.pop("length", None)
+    else:
+        out["length"] = max(stream1["length"], stream2["length"])
+    return out
+
+
+def stream_convolve(stream, kernel, method="auto"):
+    """
+    Streaming version of convolve: given a mono stream and a kernel (a list or
+    a sparse dictionary, as for convolve), return a stream of their
+    convolution, which is len(kernel) - 1 samples longer
+    """
+    length, taps = _kernel_taps(kernel)
+    if not length:
+        raise ValueError("stream_convolve needs a nonempty kernel")
+
+    def blocks():
+        carry = []
+        blockMethod = None
+        plan = None
+        for block in _mono_blocks(stream):
+            if blockMethod is None:
+                # the method (and FFT size) is decided once, for blocks of at
+                # least STREAM_BLOCK_SIZE, so that a short first block doesn't
+                # pin the whole stream to the method that suits a few samples
+                blockSize = max(len(block), STREAM_BLOCK_SIZE)
+                blockMethod = _convolve_method(blockSize, length, len(taps), method)
+                if blockMethod == "fft":
+                    plan = _fft_plan(blockSize, _dense_kernel(kernel, length))
+            convolved = _convolve_resolved(block, kernel, length, taps, blockMethod, plan)
+            _add_into(convolved, 0, carry)
+            yield convolved[:len(block)]
+            carry = convolved[len(block):]
+        if blockMethod is None and length > 1:
+            # an empty input still convolves to len(kernel) - 1 zeros
+            carry = [0.0] * (length - 1)
+        if carry:
+            yield carry
+
+    return _derived_stream(stream, blocks(), length - 1)
+
+
+def stream_pan(stream):
+    """
+    Streaming version of pan: given a stereo stream whose length is known,
+    return a stream that pans it from left to right
+    """
+    if stream.get("length") is None:
+        raise ValueError("stream_pan needs a stream with a known length")
+    N = stream["length"]
+
+    def blocks():
+        i = 0
+        for left, right in _stereo_blocks(stream):
+            panLeft = [0] * len(left)
+            panRight = [0] * len(left)
+            for j in range(len(left)):
+                panLeft[j] = left[j] * (1-(i + j)/(N-1))
+                panRight[j] = right[j] * (i + j)/(N-1)
+            i += len(left)
+            yield panLeft, panRight
+
+    return _derived_stream(stream, blocks())
+
+
+def stream_remove_vocals(stream):
+    """
+    Streaming version of remove_vocals: given a stereo stream, return a mono
+    stream of the difference between its left and right channels
+    """
+    blocks = (
+        [l - r for l, r in zip(left, right)] for left, right in _stereo_blocks(stream)
+    )
+    return _derived_stream(stream, blocks, stereo=False)
+
+
+# Block processors
+#
+# These run the effects on live audio, one callback's worth of samples at a
+# time: each processor keeps whatever state the effect carries from one block
+# to the next, process(block) returns the output for that block as soon as it
+# arrives, and flush() returns whatever the effect produces past the end of
+# the input.  Concatenating the outputs of every process call and of flush
+# gives the same samples as the offline effect.
+#
+# The processors allocate every buffer up front, for blocks of up to
+# block_size samples, and reuse them, so processing a block allocates nothing
+# per sample.  The blocks returned are memoryviews of the processors'
+# output buffers, valid until the next call: copy them (e.g. with list() or by
+# extending another buffer) to keep them.
+
+
+class BlockProcessor:
+    """
+    Base class for the block processors, which handles their output buffers.
+    """
+
+    def __init__(self, block_size=256, channels=1):
+        self.block_size = block_size
+        self._out = [array("d", bytes(8 * block_size)) for _ in range(channels)]
+
+    def _output(self, length):
+        """
+        Return the output buffers, grown if needed to hold length samples.
+        """
+        if length > len(self._out[0]):
+            self._out = [array("d", bytes(8 * length)) for _ in self._out]
+        return self._out
+
+    def flush(self):
+        """
+        Return the output left once the input is over (none, by default).
+        """
+        return memoryview(self._out[0])[:0]
+
+
+class EchoProcessor(BlockProcessor):
+    """
+    Block-by-block version of echo, for a sound with the given sampling rate.
+    The previous num_echoes * sample_delay input samples and sample_delay
+    output samples are kept in ring buffers, and each output sample comes from
+    the same feedback comb as in _echo_blocks (or, when abs(scale) > 1, the
+    same direct sum of echoes), so the results are exactly the same as echo's.
+    """
+
+    def __init__(self, rate, num_echoes, delay, scale, block_size=256):
+        super().__init__(block_size)
+        self.sample_delay = sample_delay = round(delay * rate)
+        self.num_echoes = num_echoes
+        self.scale = scale
+        # the same products and sums as _echo_blocks, rounded the same way
+        self._cancelScale = 1
+        self._gain = 0
+        self._echoScales = []
+        for _ in range(num_echoes + 1):
+            self._echoScales.append(self._cancelScale)
+            self._gain += self._cancelScale
+            self._cancelScale *= scale
+        self._inputs = array("d", bytes(8 * (num_echoes + 1) * sample_delay))
+        self._outputs = array("d", bytes(8 * sample_delay))
+        self._position = 0
+        self._tail = array("d", bytes(8 * num_echoes * sample_delay))
+
+    def process(self, block):
+        """
+        Given the next block of input samples, return the next len(block)
+        samples of the echoed sound.
+        """
+        out = self._output(len(block))[0]
+        if self.sample_delay == 0:
+            # every echo lands on top of the original, so this is just a gain
+            gain = self._gain
+            for i in range(len(block)):
+                out[i] = block[i] * gain
+            return memoryview(out)[:len(block)]
+        if abs(self.scale) > 1:
+            self._run_direct(block, out)
+        else:
+            self._run(block, out)
+        return memoryview(out)[:len(block)]
+
+    def flush(self):
+        """
+        Return the num_echoes * sample_delay samples of echo tail.
+        """
+        if self.sample_delay:
+            zeros = itertools.repeat(0, len(self._tail))
+            if abs(self.scale) > 1:
+                self._run_direct(zeros, self._tail)
+            else:
+                self._run(zeros, self._tail)
+        return memoryview(self._tail)
+
+    def _run(self, samples, out):
+        """
+        Push samples through the comb filter, writing the results into out.
+        """
+        inputs = self._inputs
+        outputs = self._outputs
+        scale = self.scale
+        cancelScale = self._cancelScale
+        delay = self.sample_delay
+        # the input ring is num_echoes + 1 times as long as the output ring, so
+        # one position counts around the input ring and its remainder around
+        # the output ring
+        inputLength = len(inputs)
+        position = self._position
+        for i, x in enumerate(samples):
+            y = x + scale * outputs[position % delay] - cancelScale * inputs[position]
+            inputs[position] = x
+            outputs[position % delay] = y
+            out[i] = y
+            position += 1
+            if position == inputLength:
+                position = 0
+        self._position = position
+
+    def _run_direct(self, samples, out):
+        """
+        Add up each sample's echoes directly, writing the results into out.
+        The comb filter in _run would amplify its rounding errors when
+        abs(scale) > 1, as explained in _echo_blocks.
+        """
+        inputs = self._inputs
+        echoScales = self._echoScales
+        delay = self.sample_delay
+        inputLength = len(inputs)
+        position = self._position
+        for i, x in enumerate(samples):
+            inputs[position] = x
+            y = 0
+            # each echo reads one delay further back (negative offsets wrap
+            # around the ring)
+            offset = position
+            for echoScale in echoScales:
+                y = y + echoScale * inputs[offset]
+                offset -= delay
+            out[i] = y
+            position += 1
+            if position == inputLength:
+                position = 0
+        self._position = position
+
+
+class ConvolveProcessor(BlockProcessor):
+    """
+    Block-by-block version of convolve, using a PartitionedConvolver (so the
+    results agree with convolve's "fft" method, up to floating-point error).
+    kernel can be a list of taps or a sparse dictionary, as for convolve.
+    Every block must hold block_size samples (a power of two), except that the
+    final one may be shorter.
+    """
+
+    def __init__(self, kernel, block_size=256):
+        super().__init__(block_size)
+        length, _ = _kernel_taps(kernel)
+        if not length:
+            raise ValueError("ConvolveProcessor needs a nonempty kernel")
+        self._convolver = PartitionedConvolver(_dense_kernel(kernel, length), block_size)
+
+    def process(self, block):
+        """
+        Given the next block of input samples, return the next len(block)
+        samples of the convolution.
+        """
+        out = self._output(len(block))[0]
+        self._convolver._process_into(block, out)
+        return memoryview(out)[:len(block)]
+
+    def flush(self):
+        """
+        Return the len(kernel) - 1 samples of the convolution past the end of
+        the input.
+        """
+        return memoryview(array("d", self._convolver.flush()))
+
+
+class MixProcessor(BlockProcessor):
+    """
+    Block-by-block version of mix(live, other, p), mixing the incoming sound
+    with the (mono) sound other.  If other is longer than the input, flush
+    returns the rest of it, scaled by 1 - p.
+
+    mix works with the shorter of its two sounds first, which changes how it
+    rounds the weight of the longer one; if the total number of input samples
+    is declared as length, the output matches mix exactly, and otherwise only
+    up to that rounding.
+    """
+
+    def __init__(self, other, p, length=None, block_size=256):
+        super().__init__(block_size)
+        self.other = other['samples']
+        self.p = p
+        self._position = 0
+        if length is not None and length > len(self.other):
+            self._liveScale = 1 - (1 - p)
+        else:
+            self._liveScale = p
+
+    def process(self, block):
+        """
+        Given the next block of input samples, return the next len(block)
+        samples of the mix.
+        """
+        out = self._output(len(block))[0]
+        other = self.other
+        liveScale = self._liveScale
+        otherScale = 1 - self.p
+        start = self._position
+        overlap = max(0, min(len(block), len(other) - start))
+        for i in range(overlap):
+            out[i] = block[i] * liveScale + other[start + i] * otherScale
+        for i in range(overlap, len(block)):
+            out[i] = block[i] * liveScale
+        self._position += len(block)
+        return memoryview(out)[:len(block)]
+
+    def flush(self):
+        """
+        Return the part of other past the end of the input, scaled by 1 - p.
+        """
+        rest = self.other[self._position:]
+        self._position += len(rest)
+        otherScale = 1 - self.p
+        return memoryview(array("d", [s * otherScale for s in rest]))
+
+
+class PanProcessor(BlockProcessor):
+    """
+    Block-by-block version of pan.  Since the pan depends on how far through
+    the sound each sample is, the total number of samples per channel must be
+    declared up front as length (round(seconds * rate) for a duration in
+    seconds).  Blocks are (left, right) pairs, as in stereo streams.
+    """
+
+    def __init__(self, length, block_size=256):
+        super().__init__(block_size, channels=2)
+        self.length = length
+        self._position = 0
+
+    def process(self, block):
+        """
+        Given the next (left, right) pair of blocks, return the next pair of
+        blocks of the panned sound.
+        """
+        left, right = block
+        if self._position + len(left) > self.length:
+            raise ValueError("PanProcessor got more than the %d samples it was declared with" % self.length)
+        panLeft, panRight = self._output(len(left))
+        N = self.length
+        i = self._position
+        for j in range(len(left)):
+            panLeft[j] = left[j] * (1-(i + j)/(N-1))
+            panRight[j] = right[j] * (i + j)/(N-1)
+        self._position += len(left)
+        return memoryview(panLeft)[:len(left)], memoryview(panRight)[:len(left)]
+
+    def flush(self):
+        """
+        Return an empty pair of blocks, since pan adds no samples.
+        """
+        return memoryview(self._out[0])[:0], memoryview(self._out[1])[:0]
+
+
 if __name__ == "__main__":
     # code in this block will only be run when you explicitly run your script,
     # and not when the tests are being run.  this is a good place to put your
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+"""
+Batch renderer for the 6.101 Lab 0 effects.
+
+Applies one declarative chain of effects to every WAV file in a directory,
+spreading the files across a pool of worker processes, e.g.:
+
+    python3 render.py sounds echo:5,0.3,0.6 bass_boost:1000,1.5 -o rendered
+
+Each effect is written as name or name:arg,arg,...; see EFFECTS for the names
+and the arguments each one takes.
+"""
+
+import os
+import sys
+import time
+import argparse
+import concurrent.futures
+
+import lab
+import cache
+
+
+def _mix(sound, other, p):
+    """
+    Mix sound with other (loaded from the file named in the chain), with
+    mixing ratio p, resampling other first if its sampling rate differs
+    """
+    return lab.mix(sound, other, p, match_rates=True)
+
+
+def _bass_boost(sound, n_val, scale):
+    """
+    Convolve sound with bass_boost_kernel(n_val, scale)
+    """
+    return lab.convolve(sound, lab.bass_boost_kernel(n_val, scale))
+
+
+# name -> (function, argument types, whether the effect takes a stereo sound)
+EFFECTS = {
+    "backwards": (lab.backwards, (), False),
+    "echo": (lab.echo, (int, float, float), False),
+    "mix": (_mix, (str, float), False),
+    "bass_boost": (_bass_boost, (int, float), False),
+    "pan": (lab.pan, (), True),
+    "remove_vocals": (lab.remove_vocals, (), True),
+}
+
+
+def parse_effect(spec):
+    """
+    Given an effect written as name or name:arg,arg,..., return a (name, args)
+    tuple with the arguments converted to the types that effect expects
+    """
+    name, _, rest = spec.partition(":")
+    if name not in EFFECTS:
+        raise ValueError(f"unknown effect {name!r} (expected one of {', '.join(EFFECTS)})")
+    types = EFFECTS[name][1]
+    args = rest.split(",") if rest else []
+    if len(args) != len(types):
+        raise ValueError(f"{name} takes {len(types)} argument(s), got {len(args)}")
+    return name, tuple(kind(arg) for kind, arg in zip(types, args))
+
+
+def parse_chain(specs):
+    """
+    Given a list of effect specs (or a single string of them separated by
+    whitespace), return the chain as a list of (name, args) tuples
+    """
+    if isinstance(specs, str):
+        specs = specs.split()
+    return [parse_effect(spec) for spec in specs]
+
+
+def chain_is_stereo(chain):
+    """
+    Return whether the input to the given chain should be loaded in stereo,
+    which is the case when its first effect works on stereo sounds
+    """
+    return bool(chain) and EFFECTS[chain[0][0]][2]
+
+
+def apply_chain(sound, chain, cache=None):
+    """
+    Given a sound and a chain of (name, args) tuples, apply each effect in turn
+    and return the result.  If cache (an EffectCache) is given, each step is
+    looked up there before it is computed.
+    """
+    for name, args in chain:
+        function, _, stereo = EFFECTS[name]
+        if stereo != ("left" in sound):
+            raise ValueError(f"{name} needs a {'stereo' if stereo else 'mono'} sound")
+        if name == "mix":
+            # load the other sound here, so the cache keys on its contents
+            args = (lab.load_wav(args[0], compact=True),) + args[1:]
+        if cache is None:
+            sound = function(sound, *args)
+        else:
+            sound = cache.apply(function, sound, *args, name=name)
+    return sound
+
+
+def render_file(filename, chain, out_dir, cache_dir=None, cache_bytes=None):
+    """
+    Load the given WAV file, apply the chain to it, and write the result to a
+    file of the same name in out_dir; return a dictionary of timing statistics.
+    If cache_dir is given, effect results are cached there (see cache.py),
+    holding at most cache_bytes of them.
+    """
+    effectCache = None
+    if cache_dir is not None:
+        effectCache = cache.EffectCache(cache_dir, cache_bytes or cache.DEFAULT_MAX_BYTES)
+    start = time.perf_counter()
+    sound = lab.load_wav(filename, stereo=chain_is_stereo(chain), compact=True)
+    numSamples = len(sound["left"] if "left" in sound else sound["samples"])
+    result = apply_chain(sound, chain, effectCache)
+    output = os.path.join(out_dir, os.path.basename(filename))
+    lab.write_wav(result, output)
+    seconds = time.perf_counter() - start
+    return {
+        "file": filename,
+        "output": output,
+        "samples": numSamples,
+        "seconds": seconds,
+        "samples_per_second": numSamples / seconds if seconds else float("inf"),
+        "cache_hits": effectCache.hits if effectCache else 0,
+    }
+
+
+def render_batch(directory, chain, out_dir, workers=None, report=None, cache_dir=None, cache_bytes=None):
+    """
+    Render every WAV file in directory through chain into out_dir, using a
+    pool of workers processes (os.cpu_count() by default).  report, if given,
+    is called with each file's statistics as soon as that file is done.
+    cache_dir and cache_bytes are passed on to render_file.
+    Return the list of statistics, in the order of the files' names.
+    """
+    filenames = sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.lower().endswith(".wav")
+    )
+    os.makedirs(out_dir, exist_ok=True)
+
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = {pool.submit(render_file, name, chain, out_dir, cache_dir, cache_bytes): name for name in filenames}
+        for job in concurrent.futures.as_completed(jobs):
+            stats = job.result()
+            results[jobs[job]] = stats
+            if report is not None:
+                report(stats)
+    return [results[name] for name in filenames]
+
+
+def print_stats(stats):
+    print(
+        f"{stats['file']}: {stats['seconds']:.3f}s, "
+        f"{stats['samples_per_second']:,.0f} samples/s"
+        f"{' (%d cached)' % stats['cache_hits'] if stats.get('cache_hits') else ''}"
+        f" -> {stats['output']}",
+        flush=True,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="apply a chain of lab 0 effects to a directory of WAV files")
+    parser.add_argument("directory", help="directory of WAV files to render")
+    parser.add_argument("effects", nargs="+", help=f"effects to apply in order, as name or name:arg,...; one of {', '.join(EFFECTS)}")
+    parser.add_argument("-o", "--out-dir", default="rendered", help="where to write the results (default: rendered)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--cache-dir", default=None, help="cache effect results in this directory")
+    parser.add_argument("--cache-mb", type=float, default=None, help="size cap for the cache in megabytes (default: 1024)")
+    args = parser.parse_args(argv)
+
+    try:
+        chain = parse_chain(args.effects)
+    except ValueError as e:
+        parser.error(str(e))
+
+    start = time.perf_counter()
+    cacheBytes = None if args.cache_mb is None else int(args.cache_mb * 2**20)
+    results = render_batch(
+        args.directory, chain, args.out_dir, args.workers,
+        report=print_stats, cache_dir=args.cache_dir, cache_bytes=cacheBytes,
+    )
+    seconds = time.perf_counter() - start
+    total = sum(stats["samples"] for stats in results)
+    print(f"rendered {len(results)} file(s) in {seconds:.3f}s ({total / seconds if seconds else 0:,.0f} samples/s overall)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+
+"""
+6.101 Lab 0 Audio Rendering Server
+
+Renders a chain of effects (written as for render.py) and streams the
+resulting WAV file back with chunked transfer encoding while it is computed:
+
+    GET  /effects                                   the effects and their arguments
+    GET  /sounds                                    the bundled sounds
+    GET  /render?sound=chord.wav&chain=echo:5,0.3,0.6+bass_boost:1000,1.5
+    POST /render?chain=pan+remove_vocals            (with a WAV file as the body)
+
+The rendering runs in a pool of worker processes.  Chains made only of effects
+that have a streaming version are rendered block by block through lab.py's
+streaming pipeline, so the first bytes go out as soon as the first blocks are
+done; other chains (those using backwards) are rendered whole and then sent in
+chunks.  The arguments of mix name one of the bundled sounds.
+"""
+
+import io
+import os
+import sys
+import json
+import struct
+import asyncio
+import argparse
+import functools
+import traceback
+import multiprocessing
+import concurrent.futures
+from queue import Empty, Full
+from urllib.parse import urlsplit, parse_qs
+
+import lab
+import render
+
+LOCATION = os.path.realpath(os.path.dirname(__file__))
+SOUNDS = os.path.join(LOCATION, "sounds")
+PORT = 6101
+
+# largest WAV file accepted as a request body
+MAX_BODY_BYTES = 256 << 20
+
+# workers batch encoded samples into messages of about this many bytes
+SEND_BYTES = 1 << 16
+
+# at most this many messages wait between a worker and a slow client
+QUEUE_MESSAGES = 16
+
+# how long a worker or the server blocks on a queue before checking whether
+# the other side has gone away
+POLL_SECONDS = 0.5
+
+
+def _stream_mix(stream, other, p):
+    """
+    Streaming version of render's mix: mix stream with the WAV file named other,
+    resampling it (whole, since it is one of the bundled sounds) if its
+    sampling rate differs
+    """
+    other = lab.stream_wav(other)
+    if other["rate"] != stream["rate"]:
+        other = lab.stream_sound(lab.resample(lab.collect_stream(other), stream["rate"]))
+    return lab.stream_mix(stream, other, p)
+
+
+def _stream_bass_boost(stream, n_val, scale):
+    """
+    Streaming version of render's bass_boost
+    """
+    return lab.stream_convolve(stream, lab.bass_boost_kernel(n_val, scale))
+
+
+# effect name -> the streaming stage that computes it
+STREAM_STAGES = {
+    "echo": lab.stream_echo,
+    "mix": _stream_mix,
+    "bass_boost": _stream_bass_boost,
+    "pan": lab.stream_pan,
+    "remove_vocals": lab.stream_remove_vocals,
+}
+
+
+def resolve_sound(name):
+    """
+    Return the path of the bundled sound with the given file name, raising
+    ValueError if there is no such sound
+    """
+    path = os.path.join(SOUNDS, name)
+    if os.path.basename(name) != name or not name.lower().endswith(".wav") or not os.path.isfile(path):
+        raise ValueError(f"unknown sound {name!r}")
+    return path
+
+
+def prepare_chain(spec):
+    """
+    Parse a chain of effects written as for render.py (separated by spaces or
+    plus signs), resolve the sounds that mix refers to, and check that each
+    effect gets the number of channels it needs; return the chain as a list of
+    (name, args) tuples, or raise ValueError
+    """
+    chain = render.parse_chain(spec.replace("+", " "))
+    stereo = render.chain_is_stereo(chain)
+    prepared = []
+    for name, args in chain:
+        if render.EFFECTS[name][2] != stereo:
+            raise ValueError(f"{name} needs a {'stereo' if render.EFFECTS[name][2] else 'mono'} sound")
+        if name == "remove_vocals":
+            stereo = False
+        if name == "mix":
+            args = (resolve_sound(args[0]),) + args[1:]
+        prepared.append((name, args))
+    return prepared
+
+
+def is_streamable(chain):
+    """
+    Return whether every effect in the chain has a streaming version
+    """
+    return all(name in STREAM_STAGES for name, _ in chain)
+
+
+def wav_header(channels, rate, frames):
+    """
+    Return the 44-byte header of a 16-bit PCM WAV file with the given number
+    of channels, sampling rate and number of frames
+    """
+    size = 2 * channels * frames
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + size, b"WAVE",
+        b"fmt ", 16, 1, channels, rate, 2 * channels * rate, 2 * channels, 16,
+        b"data", size,
+    )
+
+
+def render_chunks(source, chain):
+    """
+    Given a WAV file (a filename or a file object) and a prepared chain,
+    yield the bytes of the rendered WAV file: the header first, and then the
+    encoded samples as they are computed
+    """
+    stereo = render.chain_is_stereo(chain)
+    if is_streamable(chain):
+        stream = lab.stream_wav(source, stereo=stereo)
+        for name, args in chain:
+            stream = STREAM_STAGES[name](stream, *args)
+        yield wav_header(2 if stream["stereo"] else 1, stream["rate"], stream["length"])
+        for block in stream["blocks"]:
+            if stream["stereo"]:
+                yield lab._encode_stereo(*block).tobytes()
+            else:
+                yield lab._encode_samples(block).tobytes()
+        return
+
+    sound = render.apply_chain(lab.load_wav(source, stereo=stereo, compact=True), chain)
+    if "left" in sound:
+        left, right = sound["left"], sound["right"]
+        frames = min(len(left), len(right))
+        yield wav_header(2, sound["rate"], frames)
+        for start in range(0, frames, lab.WAV_CHUNK_FRAMES):
+            end = start + lab.WAV_CHUNK_FRAMES
+            yield lab._encode_stereo(left[start:end], right[start:end]).tobytes()
+    else:
+        samples = sound["samples"]
+        yield wav_header(1, sound["rate"], len(samples))
+        for start in range(0, len(samples), lab.WAV_CHUNK_FRAMES):
+            yield lab._encode_samples(samples[start:start + lab.WAV_CHUNK_FRAMES]).tobytes()
+
+
+def render_to_queue(source, chain, queue, cancel):
+    """
+    Run in a worker process: render source (a filename, or the bytes of a WAV
+    file) through chain, putting ("data", bytes) messages on queue as the
+    output is computed, followed by ("done", None), or ("error", message) if
+    rendering fails.  queue should be bounded, so a slow reader holds the
+    worker back; once cancel (an Event) is set, the worker stops between
+    chunks and returns without finishing.
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    try:
+        chunks = render_chunks(source, chain)
+        # the header goes out on its own, so clients get it right away
+        _put(queue, ("data", next(chunks)), cancel)
+        pending = []
+        pendingBytes = 0
+        for chunk in chunks:
+            pending.append(chunk)
+            pendingBytes += len(chunk)
+            if pendingBytes >= SEND_BYTES:
+                _put(queue, ("data", b"".join(pending)), cancel)
+                pending = []
+                pendingBytes = 0
+        if pending:
+            _put(queue, ("data", b"".join(pending)), cancel)
+        _put(queue, ("done", None), cancel)
+    except _Cancelled:
+        pass
+    except Exception:
+        try:
+            _put(queue, ("error", traceback.format_exc()), cancel)
+        except _Cancelled:
+            pass
+
+
+class _Cancelled(Exception):
+    pass
+
+
+def _put(queue, message, cancel):
+    """
+    Put message on queue, waiting for room, but raise _Cancelled instead if
+    cancel gets set in the meantime.
+    """
+    while True:
+        if cancel.is_set():
+            raise _Cancelled
+        try:
+            queue.put(message, timeout=POLL_SECONDS)
+            return
+        except Full:
+            pass
+
+
+class RenderServer:
+    """
+    The state shared by every connection: the pool of rendering processes,
+    and the manager whose queues carry their output back.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.pool = self._new_pool()
+        self.manager = multiprocessing.Manager()
+
+    def _new_pool(self):
+        # workers are started on demand, so forking them would hand them
+        # copies of whatever client sockets are open at the time, keeping
+        # those connections from closing; spawned workers start clean
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    def _replace_broken_pool(self, pool):
+        """
+        Replace pool with a fresh one if a worker died and broke it (unless
+        another request has already done so).
+        """
+        if self.pool is pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = self._new_pool()
+
+    def _submit(self, *args):
+        """
+        Submit a render job, replacing the pool first if it is broken.
+        """
+        try:
+            return self.pool.submit(render_to_queue, *args)
+        except concurrent.futures.process.BrokenProcessPool:
+            self._replace_broken_pool(self.pool)
+            return self.pool.submit(render_to_queue, *args)
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+        self.manager.shutdown()
+
+    async def handle(self, reader, writer):
+        """
+        Serve one request on a connection, then close it.
+        """
+        try:
+            method, target, body = await _read_request(reader)
+            url = urlsplit(target)
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            if url.path == "/effects":
+                effects = {name: [kind.__name__ for kind in types] for name, (_, types, _) in render.EFFECTS.items()}
+                await _respond(writer, "200 OK", "application/json", json.dumps(effects).encode())
+            elif url.path == "/sounds":
+                sounds = sorted(name for name in os.listdir(SOUNDS) if name.lower().endswith(".wav"))
+                await _respond(writer, "200 OK", "application/json", json.dumps(sounds).encode())
+            elif url.path == "/render" and method in ("GET", "POST"):
+                await self.render(writer, params, body)
+            else:
+                await _respond(writer, "404 NOT FOUND", "text/plain", b"not found\n")
+        except _BadRequest as e:
+            await _respond(writer, e.status, "text/plain", (str(e) + "\n").encode())
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def render(self, writer, params, body):
+        """
+        Check a render request, then stream the rendered WAV file back while a
+        worker computes it.
+        """
+        try:
+            chain = prepare_chain(params.get("chain", ""))
+            if "sound" in params:
+                source = resolve_sound(params["sound"])
+            elif body:
+                source = body
+            else:
+                raise ValueError("give a sound parameter or a WAV file as the request body")
+        except ValueError as e:
+            raise _BadRequest(str(e))
+
+        messages = self.manager.Queue(QUEUE_MESSAGES)
+        cancel = self.manager.Event()
+        pool = self.pool
+        job = self._submit(source, chain, messages, cancel)
+        finished = False
+        try:
+            kind, data = await self._next_message(messages, job, pool)
+            if kind == "error":
+                # nothing has been sent yet, so this can still be reported properly
+                print(data, end="", file=sys.stderr)
+                raise _BadRequest(data.strip().splitlines()[-1], "500 INTERNAL SERVER ERROR")
+
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: audio/wav\r\n"
+                b"Transfer-Encoding: chunked\r\n"
+                b"Connection: close\r\n\r\n"
+            )
+            while kind == "data":
+                writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+                await writer.drain()
+                kind, data = await self._next_message(messages, job, pool)
+            if kind == "error":
+                # the status is already out, so cut the response off without its
+                # final chunk, which tells the client it is incomplete
+                print(data, end="", file=sys.stderr)
+                return
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+            finished = True
+        finally:
+            if not finished:
+                # the client went away (or the render failed): stop the worker
+                # rather than have it render into a queue nobody reads
+                cancel.set()
+
+    async def _next_message(self, messages, job, pool):
+        """
+        Wait for the next message from the worker running job, without tying
+        up a thread for more than POLL_SECONDS at a time.  If the worker stops
+        without sending one (because it was killed, say), return an error
+        message instead of waiting forever.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                return await loop.run_in_executor(None, functools.partial(messages.get, timeout=POLL_SECONDS))
+            except Empty:
+                if not job.done():
+                    continue
+            # the job may have put its last message just before finishing
+            try:
+                return messages.get_nowait()
+            except Empty:
+                pass
+            error = job.exception()
+            if isinstance(error, concurrent.futures.process.BrokenProcessPool):
+                self._replace_broken_pool(pool)
+            return ("error", f"render worker stopped without finishing: {error!r}\n")
+
+
+class _BadRequest(Exception):
+    def __init__(self, message, status="400 BAD REQUEST"):
+        super().__init__(message)
+        self.status = status
+
+
+async def _read_request(reader):
+    """
+    Read an HTTP request from reader and return its method, target and body.
+    """
+    line = await reader.readline()
+    parts = line.decode("latin-1").split()
+    if len(parts) != 3:
+        raise _BadRequest("malformed request line")
+    method, target, _ = parts
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise _BadRequest("bad Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise _BadRequest("request body too large", "413 PAYLOAD TOO LARGE")
+    body = await reader.readexactly(length) if length else b""
+    return method, target, body
+
+
+async def _respond(writer, status, content_type, body):
+    writer.write(
+        f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+
+
+async def serve(host="", port=PORT, workers=None):
+    """
+    Run the server until it is cancelled.
+    """
+    state = RenderServer(workers)
+    try:
+        server = await asyncio.start_server(state.handle, host or None, port)
+        async with server:
+            await server.serve_forever()
+    finally:
+        state.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="serve lab 0 effect chains over HTTP")
+    parser.add_argument("--host", default="", help="address to listen on (default: all)")
+    parser.add_argument("--port", type=int, default=PORT, help=f"port to listen on (default: {PORT})")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes (default: one per CPU)")
+    args = parser.parse_args(argv)
+
+    print(f"starting server.  navigate to http://localhost:{args.port}/effects")
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        print("Shutting down.")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,11 +2,23 @@
 
 import os
 import copy
+import time
+import queue
+import asyncio
+import math
 import pickle
+import random
+import threading
+import concurrent.futures
+from fractions import Fraction
 
 import pytest
 
 import lab
+import cache
+import render
+import bench
+import server
 
 TEST_DIRECTORY = os.path.dirname(__file__)
 
@@ -180,6 +192,21 @@ def test_convolve_real():
     assert inp == inp2, "be careful not to modify the input!"
 
 
+@pytest.mark.parametrize("num_samples, num_taps", [(1, 40), (500, 13), (3000, 257)])
+def test_convolve_fft_matches_direct(num_samples, num_taps):
+    rng = random.Random(num_samples * num_taps)
+    inp = {
+        "rate": 8000,
+        "samples": [rng.uniform(-1, 1) for _ in range(num_samples)],
+    }
+    kern = [rng.uniform(-1, 1) for _ in range(num_taps)]
+    inp2 = copy.deepcopy(inp)
+    exp = lab.convolve(inp, kern, method="direct")
+    compare_sounds(lab.convolve(inp, kern, method="fft"), exp, eps=1e-9)
+    compare_sounds(lab.convolve(inp, kern), exp, eps=1e-9)
+    assert inp == inp2, "be careful not to modify the inputs!"
+
+
 def test_echo_small():
     inp = {
         "rate": 9,
@@ -265,3 +292,834 @@ def test_remove_vocals_random(test_number):
     inps2 = copy.deepcopy(inps)
     compare_sounds(lab.remove_vocals(*inps), exp)
     assert inps == inps2, "be careful not to modify the input!"
+
+
+@pytest.mark.parametrize("stereo", [False, True])
+def test_write_wav_round_trip(tmp_path, stereo):
+    inp = lab.load_wav(
+        os.path.join(TEST_DIRECTORY, "sounds", "mystery.wav"), stereo=stereo
+    )
+    inp2 = copy.deepcopy(inp)
+    outfile = str(tmp_path / "out.wav")
+    lab.write_wav(inp, outfile)
+    compare_against_file(inp, outfile, stereo=stereo)
+    assert inp == inp2, "be careful not to modify the input!"
+
+
+def test_write_wav_uneven_stereo(tmp_path):
+    # channels of different lengths are cut to the shorter one
+    outfile = str(tmp_path / "out.wav")
+    lab.write_wav(
+        {"rate": 8000, "left": [0.5, -0.5, 0.25], "right": [0.1, 0.2]}, outfile
+    )
+    compare_against_file(
+        {"rate": 8000, "left": [0.5, -0.5], "right": [0.1, 0.2]}, outfile, stereo=True
+    )
+
+
+@pytest.mark.parametrize("stereo", [False, True])
+def test_map_wav(stereo):
+    fname = os.path.join(TEST_DIRECTORY, "sounds", "car.wav")
+    mapped = lab.map_wav(fname, stereo=stereo)
+    compare_sounds(mapped, lab.load_wav(fname, stereo=stereo))
+    if stereo:
+        compare_against_file(
+            lab.pan(mapped), os.path.join(TEST_DIRECTORY, "car_pan.wav"), stereo=True
+        )
+    else:
+        assert lab.backwards(mapped)["samples"][:10] == list(
+            mapped["samples"][-1:-11:-1]
+        )
+
+
+def test_compact_sounds():
+    fname = os.path.join(TEST_DIRECTORY, "sounds", "mystery.wav")
+    mono = lab.load_wav(fname)
+    stereo = lab.load_wav(fname, stereo=True)
+    compact_mono = lab.load_wav(fname, compact=True)
+    compact_stereo = lab.load_wav(fname, stereo=True, compact=True)
+    assert isinstance(compact_mono, lab.Sound)
+    assert isinstance(compact_stereo, lab.StereoSound)
+    compare_sounds(compact_mono, mono)
+    compare_sounds(compact_stereo, stereo)
+
+    inp2 = copy.deepcopy(compact_mono)
+    for result, expected in [
+        (lab.backwards(compact_mono), lab.backwards(mono)),
+        (lab.mix(compact_mono, mono, 0.3), lab.mix(mono, mono, 0.3)),
+        (lab.echo(compact_mono, 2, 0.1, 0.5), lab.echo(mono, 2, 0.1, 0.5)),
+        (lab.convolve(compact_mono, [0.5, 0.25]), lab.convolve(mono, [0.5, 0.25])),
+        (lab.pan(compact_stereo), lab.pan(stereo)),
+        (lab.remove_vocals(compact_stereo), lab.remove_vocals(stereo)),
+    ]:
+        assert isinstance(result, lab.Sound)
+        compare_sounds(result, expected)
+    assert compact_mono == inp2, "be careful not to modify the input!"
+
+
+def test_stream_pipeline(tmp_path):
+    chord = os.path.join(TEST_DIRECTORY, "sounds", "chord.wav")
+    crash = os.path.join(TEST_DIRECTORY, "sounds", "crash.wav")
+    kern = lab.bass_boost_kernel(5, 1.5)
+    expected = lab.mix(
+        lab.convolve(lab.echo(lab.load_wav(chord), 2, 0.1, 0.6), kern),
+        lab.load_wav(crash),
+        0.4,
+    )
+
+    stream = lab.stream_wav(chord, block_size=1000)
+    stream = lab.stream_echo(stream, 2, 0.1, 0.6)
+    stream = lab.stream_convolve(stream, kern)
+    stream = lab.stream_mix(stream, lab.stream_wav(crash, block_size=777), 0.4)
+    assert stream["length"] == len(expected["samples"])
+    outfile = str(tmp_path / "out.wav")
+    lab.write_wav_stream(stream, outfile)
+    compare_against_file(expected, outfile)
+
+
+def test_stream_convolve_short_first_block(monkeypatch):
+    # a short first block mustn't decide the method for the whole stream
+    random.seed(6)
+    samples = [random.uniform(-1, 1) for _ in range(9001)]
+    kern = lab.bass_boost_kernel(100, 1.5)
+    chosen = []
+    method = lab._convolve_method
+    monkeypatch.setattr(
+        lab, "_convolve_method", lambda *args: chosen.append(args[0]) or method(*args)
+    )
+    stream = {
+        "rate": 8000,
+        "blocks": iter([samples[:1], samples[1:5001], samples[5001:]]),
+        "length": len(samples),
+        "stereo": False,
+    }
+    result = lab.collect_stream(lab.stream_convolve(stream, kern))
+    assert chosen == [lab.STREAM_BLOCK_SIZE]
+    compare_sounds(result, lab.convolve({"rate": 8000, "samples": samples}, kern))
+
+
+def test_stream_convolve_empty():
+    # an empty stream still convolves to len(kernel) - 1 zeros, like convolve
+    for kern in ([0.5], [1, -1, 2], {3: 1.0}):
+        sound = {"rate": 8000, "samples": []}
+        stream = lab.stream_convolve(lab.stream_sound(sound), kern)
+        result = lab.collect_stream(stream)
+        assert stream["length"] == len(result["samples"])
+        compare_sounds(result, lab.convolve(sound, kern))
+
+
+def test_stream_stereo():
+    inp = lab.load_wav(
+        os.path.join(TEST_DIRECTORY, "sounds", "mystery.wav"), stereo=True
+    )
+    compare_sounds(
+        lab.collect_stream(lab.stream_pan(lab.stream_sound(inp, 300))), lab.pan(inp)
+    )
+    compare_sounds(
+        lab.collect_stream(lab.stream_remove_vocals(lab.stream_sound(inp, 300))),
+        lab.remove_vocals(inp),
+    )
+
+
+@pytest.mark.parametrize(
+    "num_echoes, delay, scale",
+    [(0, 0.3, 0.6), (4, 0, 0.5), (3, 0.001, 0.9), (12, 0.05, 1.1)],
+)
+def test_echo_streaming_matches_offline(num_echoes, delay, scale):
+    inp = lab.load_wav(os.path.join(TEST_DIRECTORY, "sounds", "meow.wav"))
+    exp = {
+        "rate": inp["rate"],
+        "samples": [0]
+        * (len(inp["samples"]) + num_echoes * round(delay * inp["rate"])),
+    }
+    echo_scale = 1
+    for echo in range(num_echoes + 1):
+        for ix, sample in enumerate(inp["samples"]):
+            exp["samples"][ix + echo * round(delay * inp["rate"])] += (
+                sample * echo_scale
+            )
+        echo_scale *= scale
+    compare_sounds(lab.echo(inp, num_echoes, delay, scale), exp, eps=1e-9)
+    stream = lab.stream_echo(lab.stream_sound(inp, 1234), num_echoes, delay, scale)
+    compare_sounds(lab.collect_stream(stream), exp, eps=1e-9)
+
+
+@pytest.mark.parametrize(
+    "num_echoes, delay, scale", [(3, 0.001, 2.0), (5, 0.001, -1.5), (2, 0.005, 1.2)]
+)
+def test_echo_loud_echoes_stay_exact(num_echoes, delay, scale):
+    random.seed(7)
+    inp = {"rate": 8000, "samples": [random.uniform(-1, 1) for _ in range(40000)]}
+    sample_delay = round(delay * inp["rate"])
+    exp = {
+        "rate": 8000,
+        "samples": [0] * (len(inp["samples"]) + num_echoes * sample_delay),
+    }
+    echo_scale = 1
+    for echo in range(num_echoes + 1):
+        for ix, sample in enumerate(inp["samples"]):
+            exp["samples"][ix + echo * sample_delay] += sample * echo_scale
+        echo_scale *= scale
+    compare_sounds(lab.echo(inp, num_echoes, delay, scale), exp, eps=1e-9)
+    stream = lab.stream_echo(lab.stream_sound(inp, 1234), num_echoes, delay, scale)
+    compare_sounds(lab.collect_stream(stream), exp, eps=1e-9)
+    compact = lab.echo(lab.Sound(8000, inp["samples"]), num_echoes, delay, scale)
+    assert isinstance(compact["samples"], lab.array)
+    compare_sounds({"rate": 8000, "samples": list(compact["samples"])}, exp, eps=1e-9)
+
+
+@pytest.mark.parametrize("n_val, scale", [(0, 1), (3, 2.5), (40, 1.5)])
+def test_bass_boost_kernel(n_val, scale):
+    base = [0.25, 0.5, 0.25]
+    exp = list(base)
+    for _ in range(n_val):
+        exp = lab.convolve({"rate": 0, "samples": exp}, base, method="direct")[
+            "samples"
+        ]
+    exp = [i * scale for i in exp]
+    exp[len(exp) // 2] += 1
+
+    kern = lab.bass_boost_kernel(n_val, scale)
+    compare_sounds({"rate": 0, "samples": kern}, {"rate": 0, "samples": exp}, eps=1e-12)
+    kern[0] += 100
+    assert lab.bass_boost_kernel(n_val, scale)[0] == pytest.approx(
+        exp[0]
+    ), "cached kernels should not be shared"
+
+
+@pytest.mark.parametrize("block_size", [32, 256])
+def test_partitioned_convolver(block_size):
+    inp = lab.load_wav(os.path.join(TEST_DIRECTORY, "sounds", "meow.wav"))
+    inp = {"rate": inp["rate"], "samples": inp["samples"][:20000]}
+    kern = lab.bass_boost_kernel(300, 1.5)
+    convolver = lab.PartitionedConvolver(kern, block_size)
+    out = []
+    for start in range(0, len(inp["samples"]), block_size):
+        block = convolver.process(inp["samples"][start : start + block_size])
+        assert len(block) == len(inp["samples"][start : start + block_size])
+        out.extend(block)
+    out.extend(convolver.flush())
+    compare_sounds(
+        {"rate": inp["rate"], "samples": out}, lab.convolve(inp, kern), eps=1e-9
+    )
+
+
+def test_partitioned_convolver_arguments():
+    for kernel, block_size in [([], 32), ([1.0], 0), ([1.0], 48)]:
+        with pytest.raises(ValueError):
+            lab.PartitionedConvolver(kernel, block_size)
+
+
+def test_convolve_sparse():
+    inp = {"rate": 20, "samples": [3, 0, -2, 1, 0, 4]}
+    inp2 = copy.deepcopy(inp)
+    exp = {
+        "rate": 20,
+        "samples": [6, 15, -4, 4, 5, 0, 24, 0, 16],
+    }
+    compare_sounds(lab.convolve(inp, {0: 2, 1: 5, 3: 4}), exp)
+    compare_sounds(lab.convolve(inp, [2, 5, 0, 4], method="sparse"), exp)
+    compare_sounds(lab.convolve(inp, {3: 4, 0: 2, 1: 5, 2: 0}, method="fft"), exp)
+    assert inp == inp2, "be careful not to modify the inputs!"
+
+    inp = lab.load_wav(os.path.join(TEST_DIRECTORY, "sounds", "synth.wav"))
+    delay = round(0.5 * inp["rate"])
+    kern = {delay * echo: 0.7**echo for echo in range(7)}
+    outfile = os.path.join(TEST_DIRECTORY, "test_outputs", "synth_echo.wav")
+    compare_against_file(lab.convolve(inp, kern), outfile)
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_convolve_parallel(workers):
+    rng = random.Random(workers)
+    inp = {"rate": 8000, "samples": [rng.uniform(-1, 1) for _ in range(5000)]}
+    kern = [rng.uniform(-1, 1) if rng.random() < 0.5 else 0 for _ in range(150)]
+    inp2 = copy.deepcopy(inp)
+    res = lab.convolve(inp, kern, method="parallel", workers=workers)
+    assert res["samples"] == lab.convolve(inp, kern, method="direct")["samples"]
+    assert inp == inp2, "be careful not to modify the inputs!"
+
+    # errors come through as themselves, not as a failure to free the buffers
+    with pytest.raises(TypeError):
+        lab.convolve(
+            {"rate": 1, "samples": [1, 2, "x"]},
+            [1, 2, 3],
+            method="parallel",
+            workers=workers,
+        )
+
+
+def test_render_batch(tmp_path):
+    in_dir = tmp_path / "in"
+    in_dir.mkdir()
+    for name in ["meow.wav", "mystery.wav"]:
+        sound = lab.load_wav(os.path.join(TEST_DIRECTORY, "sounds", name), stereo=True)
+        lab.write_wav(sound, str(in_dir / name))
+
+    chain = render.parse_chain("pan remove_vocals echo:2,0.1,0.5")
+    results = render.render_batch(str(in_dir), chain, str(tmp_path / "out"), workers=2)
+    assert [os.path.basename(stats["file"]) for stats in results] == [
+        "meow.wav",
+        "mystery.wav",
+    ]
+    for stats in results:
+        assert stats["samples_per_second"] > 0
+        sound = lab.load_wav(stats["file"], stereo=True)
+        expected = lab.echo(lab.remove_vocals(lab.pan(sound)), 2, 0.1, 0.5)
+        compare_against_file(expected, stats["output"])
+
+    with pytest.raises(ValueError):
+        render.parse_chain("echo:2,0.1")
+
+
+def test_effect_cache(tmp_path):
+    calls = []
+
+    def counted_echo(sound, *args):
+        calls.append(args)
+        return lab.echo(sound, *args)
+
+    inp = lab.load_wav(os.path.join(TEST_DIRECTORY, "sounds", "meow.wav"))
+    inp2 = copy.deepcopy(inp)
+    effects = cache.EffectCache(str(tmp_path))
+    exp = lab.echo(inp, 5, 0.3, 0.6)
+    compare_sounds(effects.apply(counted_echo, inp, 5, 0.3, 0.6), exp)
+    compare_sounds(effects.apply(counted_echo, inp, 5, 0.3, 0.6), exp, eps=0)
+    compare_sounds(
+        cache.EffectCache(str(tmp_path)).apply(counted_echo, inp, 5, 0.3, 0.6),
+        exp,
+        eps=0,
+    )
+    assert len(calls) == 1
+    assert inp == inp2, "be careful not to modify the input!"
+
+    compact = lab.load_wav(
+        os.path.join(TEST_DIRECTORY, "sounds", "meow.wav"), compact=True
+    )
+    assert isinstance(effects.apply(counted_echo, compact, 5, 0.3, 0.6), lab.Sound)
+    effects.apply(counted_echo, inp, 5, 0.3, 0.5)
+    assert len(calls) == 2
+
+    # capping the cache at one result's size evicts the least recently used one
+    size = effects.size() // 2
+    effects.apply(counted_echo, inp, 5, 0.3, 0.6)
+    capped = cache.EffectCache(str(tmp_path), max_bytes=size)
+    assert capped.size() == size
+    capped.apply(counted_echo, inp, 5, 0.3, 0.6)
+    assert len(calls) == 2
+    capped.apply(counted_echo, inp, 5, 0.3, 0.5)
+    assert len(calls) == 3
+
+
+def test_convolve_bank():
+    inp = lab.load_wav(os.path.join(TEST_DIRECTORY, "sounds", "meow.wav"), compact=True)
+    inp2 = copy.deepcopy(inp)
+    kernels = [lab.bass_boost_kernel(100, scale) for scale in (0.5, 1.5, 3)]
+    kernels += [[1, -2], {0: 1, 3000: 0.5}]
+    results = lab.convolve_bank(inp, kernels)
+    assert len(results) == len(kernels)
+    for result, kern in zip(results, kernels):
+        assert isinstance(result, lab.Sound)
+        compare_sounds(result, lab.convolve(inp, kern), eps=1e-9)
+    assert inp == inp2, "be careful not to modify the input!"
+
+
+def test_mix_many():
+    s1 = {"rate": 30, "samples": [1, 2, 3, 4, 5, 6]}
+    s2 = {"rate": 30, "samples": [7, 8, 9, 10]}
+    s3 = {"rate": 30, "samples": [1, 1]}
+    inps = copy.deepcopy([s1, s2, s3])
+    exp = {
+        "rate": 30,
+        "samples": [0.5 + 2.8 + 2, 1 + 3.2 + 2, 1.5 + 3.6, 2 + 4, 2.5, 3],
+    }
+    compare_sounds(lab.mix_many([s1, s2, s3], [0.5, 0.4, 2]), exp)
+    compare_sounds(lab.mix_many([s3, s1], [0.3, 0.7]), lab.mix(s3, s1, 0.3))
+    assert [s1, s2, s3] == inps, "be careful not to modify the inputs!"
+
+    stereo = lab.load_wav(
+        os.path.join(TEST_DIRECTORY, "sounds", "mystery.wav"), stereo=True, compact=True
+    )
+    doubled = lab.mix_many([stereo, stereo], [1, 1])
+    assert isinstance(doubled, lab.StereoSound)
+    compare_sounds(
+        doubled,
+        {
+            "rate": stereo["rate"],
+            "left": [2 * v for v in stereo["left"]],
+            "right": [2 * v for v in stereo["right"]],
+        },
+    )
+
+    with pytest.raises(ValueError):
+        lab.mix_many([s1, {"rate": 20, "samples": [1]}], [0.5, 0.5])
+    with pytest.raises(ValueError):
+        lab.mix_many([s1, stereo], [0.5, 0.5])
+    with pytest.raises(ValueError):
+        lab.mix_many([s1, s2], [1])
+
+
+@pytest.mark.parametrize(
+    "rate_in, rate_out", [(44100, 48000), (48000, 44100), (8000, 22050)]
+)
+def test_resample(rate_in, rate_out):
+    def tone(rate, length):
+        return [0.5 * math.sin(2 * math.pi * 440 * n / rate) for n in range(length)]
+
+    inp = {"rate": rate_in, "samples": tone(rate_in, rate_in // 4)}
+    inp2 = copy.deepcopy(inp)
+    res = lab.resample(inp, rate_out)
+    exp = {
+        "rate": rate_out,
+        "samples": tone(rate_out, -(-len(inp["samples"]) * rate_out // rate_in)),
+    }
+    assert len(res["samples"]) == len(exp["samples"])
+    # away from the edges, where the filter runs off the end of the sound
+    trim = {"rate": rate_out, "samples": res["samples"][100:-100]}
+    compare_sounds(
+        trim, {"rate": rate_out, "samples": exp["samples"][100:-100]}, eps=1e-4
+    )
+    assert inp == inp2, "be careful not to modify the input!"
+
+
+def test_mix_resample():
+    s1 = {"rate": 48000, "samples": [0.25] * 4800}
+    s2 = {"rate": 44100, "samples": [0.5] * 4410}
+    assert lab.mix(s1, s2, 0.5) is None
+    res = lab.mix(s1, s2, 0.5, match_rates=True)
+    assert res["rate"] == 48000 and len(res["samples"]) == 4800
+    compare_sounds(
+        {"rate": 48000, "samples": res["samples"][100:-100]},
+        {"rate": 48000, "samples": [0.375] * 4600},
+        eps=1e-3,
+    )
+    res = lab.mix_many([s1, s2], [0.5, 0.5], match_rates=True)
+    compare_sounds(
+        {"rate": 48000, "samples": res["samples"][100:-100]},
+        {"rate": 48000, "samples": [0.375] * 4600},
+        eps=1e-3,
+    )
+
+
+def test_lazy_views(tmp_path):
+    inp = {"rate": 5, "samples": [1, 2, 3, 4, 5, 6, 7, 8]}
+    inp2 = copy.deepcopy(inp)
+    view = lab.reversed_view(lab.slice_view(inp, 1, 7))
+    compare_sounds(view, {"rate": 5, "samples": [7, 6, 5, 4, 3, 2]})
+    view = lab.gain_view(view, lab.linear_envelope(0, 1, 6))
+    view = lab.reversed_view(lab.gain_view(view, 2))
+    compare_sounds(view, {"rate": 5, "samples": [4, 4.8, 4.8, 4, 2.4, 0]})
+    assert view["samples"][1:5:2] == pytest.approx([4.8, 4])
+    assert view["samples"][-2] == pytest.approx(2.4)
+    compare_sounds(
+        lab.materialize(view), {"rate": 5, "samples": [4, 4.8, 4.8, 4, 2.4, 0]}
+    )
+    compare_sounds(
+        lab.convolve(lab.reversed_view(inp), [1, -1]),
+        lab.convolve(lab.backwards(inp), [1, -1]),
+    )
+    assert inp == inp2, "be careful not to modify the input!"
+
+    stereo = lab.load_wav(
+        os.path.join(TEST_DIRECTORY, "sounds", "mystery.wav"), stereo=True
+    )
+    outfile = str(tmp_path / "pan.wav")
+    lab.write_wav(lab.pan_view(stereo), outfile)
+    compare_against_file(lab.pan(stereo), outfile, stereo=True)
+
+
+def test_fused_stages():
+    stereo = lab.load_wav(
+        os.path.join(TEST_DIRECTORY, "sounds", "mystery.wav"), stereo=True
+    )
+    other = lab.load_wav(os.path.join(TEST_DIRECTORY, "sounds", "crash.wav"))
+    other = {"rate": stereo["rate"], "samples": other["samples"]}
+    inp2 = copy.deepcopy(stereo)
+
+    compare_sounds(lab.fused(stereo, lab.PAN), lab.pan(stereo))
+    compare_sounds(lab.fused(stereo, lab.REMOVE_VOCALS), lab.remove_vocals(stereo))
+    stage = lab.chain_stages(lab.PAN, lab.REMOVE_VOCALS, lab.mix_stage(0.3))
+    compare_sounds(
+        lab.fused(stereo, stage, [other]),
+        lab.mix(lab.remove_vocals(lab.pan(stereo)), other, 0.3),
+    )
+    assert stereo == inp2, "be careful not to modify the input!"
+
+    buffer = lab.interleave(stereo)
+    assert len(buffer["frames"]) == 2 * len(stereo["left"])
+    panned = lab.fused(buffer, lab.PAN)
+    assert "frames" in panned
+    compare_sounds(lab.deinterleave(panned), lab.pan(stereo))
+    compare_sounds(
+        lab.fused(buffer, {"samples": (lab.LEFT + lab.RIGHT) * 0.5 - 2 * lab.RAMP}),
+        {
+            "rate": stereo["rate"],
+            "samples": [
+                (l + r) / 2 - 2 * i / (len(stereo["left"]) - 1)
+                for i, (l, r) in enumerate(zip(stereo["left"], stereo["right"]))
+            ],
+        },
+    )
+    compare_sounds(lab.fused(buffer, stage, [other]), lab.fused(stereo, stage, [other]))
+
+    for stage in (
+        {"left": lab.LEFT * 2},
+        {"right": lab.RIGHT},
+        {},
+        {"samples": lab.LEFT, "left": lab.LEFT},
+    ):
+        with pytest.raises(ValueError):
+            lab.fused(stereo, stage)
+
+    # constants whose repr isn't code are fine too
+    mono = {"rate": 8000, "samples": [0.5, -0.25, 1.0]}
+    third = lab.fused(
+        mono, lab.mix_stage(Fraction(1, 3)), [{"rate": 8000, "samples": [1.0, 0.0]}]
+    )
+    assert third["samples"] == [
+        Fraction(1, 3) * x + Fraction(2, 3) * y
+        for x, y in [(0.5, 1.0), (-0.25, 0.0), (1.0, 0)]
+    ]
+    assert (
+        lab.fused(mono, {"samples": lab.SAMPLES + float("inf")})["samples"]
+        == [float("inf")] * 3
+    )
+
+
+def test_bench_baselines():
+    assert bench.scaling_exponent(
+        [(n, 3e-6 * n**2) for n in (10, 100, 1000)]
+    ) == pytest.approx(2)
+    assert bench.scaling_exponent([(10, 1.0)]) is None
+
+    results = bench.run(quick=True, repeat=1, only="mix", report=lambda line: None)
+    assert set(results["benchmarks"]) == {"mix", "file:mix"}
+    for point in results["benchmarks"]["mix"]["points"]:
+        assert point["samples_per_second"] > 0 and point["peak_bytes"] > 0
+    assert bench.compare(results, results) == []
+
+    slower = copy.deepcopy(results)
+    for point in slower["benchmarks"]["mix"]["points"]:
+        point["seconds"] *= 2
+    regressions = bench.compare(slower, results)
+    assert [name for name, *_ in regressions] == ["mix"] * len(
+        slower["benchmarks"]["mix"]["points"]
+    )
+
+
+def test_profiling():
+    inp = lab.load_wav(os.path.join(TEST_DIRECTORY, "sounds", "meow.wav"))
+    lab.reset_stats()
+    lab.echo(inp, 2, 0.1, 0.5)
+    assert lab.stats() == {}
+
+    lines = []
+    lab.enable_profiling(log_interval=0, log=lines.append)
+    try:
+        echoed = lab.echo(inp, 2, 0.1, 0.5)
+        lab.mix(inp, echoed, 0.5)
+        lab.mix(inp, echoed, 0.7)
+    finally:
+        lab.disable_profiling()
+    lab.backwards(inp)
+
+    stats = lab.stats()
+    assert set(stats) == {"echo", "mix"}
+    assert stats["echo"]["calls"] == 1 and stats["mix"]["calls"] == 2
+    assert stats["echo"]["samples"] == len(inp["samples"])
+    assert stats["mix"]["samples"] == 2 * (len(inp["samples"]) + len(echoed["samples"]))
+    assert stats["mix"]["peak_bytes"] > 0 and stats["mix"]["seconds"] > 0
+    assert len(lines) == 3 and lines[-1].startswith("profile: ")
+    lab.reset_stats()
+    assert lab.stats() == {}
+
+
+def test_convolve_approx():
+    random.seed(21)
+    inp = {"rate": 8000, "samples": [random.uniform(-0.5, 0.5) for _ in range(3000)]}
+    kernel = lab.bass_boost_kernel(200, 1.5)
+    exp = lab.convolve(inp, kernel)
+
+    result, report = lab.convolve_approx(inp, kernel, verify=True)
+    assert len(result["samples"]) == len(exp["samples"])
+    assert report["taps"] == len(kernel) and 0 < report["kept_taps"] < len(kernel)
+    assert report["offset"] > 0 and report["estimated_speedup"] > 1
+    assert (
+        report["realised_error"] <= report["error_bound"] + 1e-12 <= lab.ONE_LSB + 1e-12
+    )
+    assert (
+        max(abs(a - b) for a, b in zip(result["samples"], exp["samples"]))
+        <= lab.ONE_LSB
+    )
+
+    result, report = lab.convolve_approx(inp, kernel, max_error=0)
+    assert report["kept_taps"] == len(kernel) and report["error_bound"] == 0
+    compare_sounds(result, exp)
+
+    parallel, _ = lab.convolve_approx(inp, kernel, method="parallel", workers=2)
+    assert (
+        parallel["samples"]
+        == lab.convolve_approx(inp, kernel, method="direct")[0]["samples"]
+    )
+
+    sparse = {0: 1, 100: 0.5, 250: 1e-9}
+    result, report = lab.convolve_approx(lab.Sound(8000, inp["samples"]), sparse)
+    assert isinstance(result, lab.Sound) and report["kept_taps"] == 101
+    compare_sounds(
+        {"rate": 8000, "samples": list(result["samples"])}, lab.convolve(inp, sparse)
+    )
+
+    # as long as convolve's output for empty sounds and kernels too
+    for samples, kernel in [([], [1, 2, 3]), ([1, 2], []), ([], {4: 1.0})]:
+        sound = {"rate": 8000, "samples": samples}
+        result, _ = lab.convolve_approx(sound, kernel)
+        assert len(result["samples"]) == len(lab.convolve(sound, kernel)["samples"])
+
+
+def test_block_processors():
+    inp = lab.load_wav(os.path.join(TEST_DIRECTORY, "sounds", "meow.wav"))
+    samples = inp["samples"]
+    blocks = [samples[i : i + 256] for i in range(0, len(samples), 256)]
+
+    def run(processor, blocks):
+        out = []
+        for block in blocks:
+            out.extend(processor.process(block))
+        out.extend(processor.flush())
+        return out
+
+    for delay in (0, 0.0005, 0.05):
+        for scale in (0.6, 1.5, -2.0):
+            processor = lab.EchoProcessor(inp["rate"], 3, delay, scale)
+            assert run(processor, blocks) == lab.echo(inp, 3, delay, scale)["samples"]
+
+    kernel = lab.bass_boost_kernel(300, 1.5)
+    result = {
+        "rate": inp["rate"],
+        "samples": run(lab.ConvolveProcessor(kernel), blocks),
+    }
+    compare_sounds(result, lab.convolve(inp, kernel))
+
+    short = {"rate": inp["rate"], "samples": samples[:5000]}
+    long = {"rate": inp["rate"], "samples": samples[::-1] + samples[:1000]}
+    compare_sounds(
+        {"rate": inp["rate"], "samples": run(lab.MixProcessor(short, 0.3), blocks)},
+        lab.mix(inp, short, 0.3),
+    )
+    assert (
+        run(lab.MixProcessor(short, 0.3, length=len(samples)), blocks)
+        == lab.mix(inp, short, 0.3)["samples"]
+    )
+    assert (
+        run(lab.MixProcessor(long, 0.3), blocks) == lab.mix(inp, long, 0.3)["samples"]
+    )
+
+    stereo = lab.load_wav(
+        os.path.join(TEST_DIRECTORY, "sounds", "meow.wav"), stereo=True
+    )
+    processor = lab.PanProcessor(len(stereo["left"]))
+    left, right = [], []
+    for i in range(0, len(stereo["left"]), 256):
+        panLeft, panRight = processor.process(
+            (stereo["left"][i : i + 256], stereo["right"][i : i + 256])
+        )
+        left.extend(panLeft)
+        right.extend(panRight)
+    assert [len(block) for block in processor.flush()] == [0, 0]
+    exp = lab.pan(stereo)
+    assert left == exp["left"] and right == exp["right"]
+    with pytest.raises(ValueError):
+        processor.process(([0.0], [0.0]))
+
+
+def test_multichannel(tmp_path):
+    random.seed(23)
+    channels = [
+        [random.randint(-32768, 32767) / 2**15 for _ in range(1000)] for _ in range(6)
+    ]
+    sound = lab.MultiSound(8000, channels)
+    assert sound.num_channels == 6 and sound.length == 1000
+    assert list(sound.channel(4)) == channels[4] and list(sound[-1]) == channels[5]
+
+    # channel views share the sound's storage
+    view = sound.channel(2)
+    view[0] = 0.5
+    assert sound.data[2 * 1000] == 0.5
+    channels[2][0] = 0.5
+
+    # effects on a channel view don't change with (or change) the sound
+    reversedView = lab.backwards(sound.channel_sound(3))
+    sound.channel(3)[0] = 99.0
+    assert list(reversedView["samples"]) == channels[3][::-1]
+    sound.channel(3)[0] = channels[3][0]
+
+    filename = str(tmp_path / "six.wav")
+    lab.write_wav(sound, filename)
+    loaded = lab.load_wav(filename, multichannel=True)
+    assert loaded.rate == 8000 and loaded.num_channels == 6
+    for index, channel in enumerate(channels):
+        assert all(
+            abs(a - b) <= 2 / 2**15 for a, b in zip(loaded.channel(index), channel)
+        )
+
+    mono = lab.load_wav(filename)
+    frames = list(zip(*(loaded.channel(index) for index in range(6))))
+    assert mono["samples"] == pytest.approx([sum(frame) / 6 for frame in frames])
+    stereo = lab.load_wav(filename, stereo=True)
+    assert stereo["left"] == list(loaded.channel(0)) and stereo["right"] == list(
+        loaded.channel(1)
+    )
+    assert list(lab.map_wav(filename)["samples"]) == mono["samples"]
+
+    for workers in (1, 2):
+        echoed = lab.map_channels(lab.echo, loaded, 2, 0.01, 0.5, workers=workers)
+        assert echoed.num_channels == 6 and echoed.length == 1000 + 2 * 80
+        for index in range(6):
+            exp = lab.echo(
+                {"rate": 8000, "samples": list(loaded.channel(index))}, 2, 0.01, 0.5
+            )
+            assert list(echoed.channel(index)) == pytest.approx(exp["samples"])
+
+
+def test_stft():
+    inp = lab.load_wav(os.path.join(TEST_DIRECTORY, "sounds", "meow.wav"), stereo=True)
+    spectrogram = lab.stft(inp, 512, 128)
+    assert spectrogram["length"] == len(inp["left"])
+    assert all(len(frame) == 257 for frame in spectrogram["left"])
+    compare_sounds(lab.istft(spectrogram), inp, eps=1e-9)
+
+    # a sinusoid that fits the frame exactly lands in a single bin
+    tone = {
+        "rate": 8000,
+        "samples": [math.sin(2 * math.pi * 10 * i / 64) for i in range(640)],
+    }
+    frames = lab.stft(tone, 64, 16, "rectangular")["samples"]
+    middle = frames[len(frames) // 2]
+    assert max(range(33), key=lambda k: abs(middle[k])) == 10
+    assert abs(middle[10]) == pytest.approx(32)
+
+    # streaming frames don't depend on how the input is split into blocks
+    samples = tone["samples"]
+    blocks = [samples[i : i + 100] for i in range(0, len(samples), 100)]
+    assert list(lab.stft_frames(blocks, 64, 16)) == lab.stft(tone, 64, 16)["samples"]
+    out = []
+    for block in lab.istft_frames(
+        lab.stft_frames(blocks, 64, 24, "hamming"), 64, 24, "hamming", len(samples)
+    ):
+        out.extend(block)
+    assert out == pytest.approx(samples, abs=1e-12)
+
+    with pytest.raises(ValueError):
+        lab.stft(tone, 64, 64, "hann")
+
+
+def test_server(tmp_path):
+    async def request(port, text, body=b""):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(
+            text.encode() + b"\r\nContent-Length: %d\r\n\r\n" % len(body) + body
+        )
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        head, _, body = response.partition(b"\r\n\r\n")
+        if b"Transfer-Encoding: chunked" in head:
+            chunks = []
+            while True:
+                size, _, body = body.partition(b"\r\n")
+                if not int(size, 16):
+                    break
+                chunks.append(body[: int(size, 16)])
+                body = body[int(size, 16) + 2 :]
+            body = b"".join(chunks)
+        return head.split(b"\r\n")[0], body
+
+    async def run():
+        state = server.RenderServer(1)
+        listener = await asyncio.start_server(state.handle, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        try:
+            with open(os.path.join(TEST_DIRECTORY, "sounds", "meow.wav"), "rb") as f:
+                upload = f.read()
+            return [
+                await request(
+                    port,
+                    "GET /render?sound=meow.wav"
+                    "&chain=echo:2,0.1,0.5+bass_boost:20,1.5 HTTP/1.1",
+                ),
+                await request(
+                    port, "POST /render?chain=pan+remove_vocals HTTP/1.1", upload
+                ),
+                await request(port, "POST /render?chain=backwards HTTP/1.1", upload),
+                await request(
+                    port, "GET /render?sound=meow.wav&chain=echo:1,0.1,0.5+pan HTTP/1.1"
+                ),
+                await request(
+                    port, "GET /render?sound=../lab.py&chain=backwards HTTP/1.1"
+                ),
+            ]
+        finally:
+            listener.close()
+            state.close()
+
+    results = asyncio.run(run())
+    inp = lab.load_wav(os.path.join(TEST_DIRECTORY, "sounds", "meow.wav"))
+    stereo = lab.load_wav(
+        os.path.join(TEST_DIRECTORY, "sounds", "meow.wav"), stereo=True
+    )
+    expected = [
+        lab.convolve(lab.echo(inp, 2, 0.1, 0.5), lab.bass_boost_kernel(20, 1.5)),
+        lab.remove_vocals(lab.pan(stereo)),
+        lab.backwards(inp),
+    ]
+    for index, (exp, (status, body)) in enumerate(zip(expected, results)):
+        assert status == b"HTTP/1.1 200 OK"
+        filename = str(tmp_path / ("%d.wav" % index))
+        with open(filename, "wb") as f:
+            f.write(body)
+        compare_against_file(exp, filename)
+    assert [status for status, _ in results[3:]] == [b"HTTP/1.1 400 BAD REQUEST"] * 2
+
+
+def test_mix_chain_resamples(tmp_path):
+    # the other sound in a chain's mix may have a different sampling rate
+    other = str(tmp_path / "other.wav")
+    lab.write_wav(
+        {"rate": 8000, "samples": [math.sin(i / 5) / 2 for i in range(4000)]}, other
+    )
+    source = os.path.join(TEST_DIRECTORY, "sounds", "meow.wav")
+    chain = [("mix", (other, 0.5))]
+    expected = lab.mix(
+        lab.load_wav(source), lab.resample(lab.load_wav(other), 44100), 0.5
+    )
+    compare_sounds(render.apply_chain(lab.load_wav(source), chain), expected)
+    outfile = str(tmp_path / "out.wav")
+    with open(outfile, "wb") as f:
+        f.write(b"".join(server.render_chunks(source, chain)))
+    compare_against_file(expected, outfile)
+
+
+def test_server_worker_failures():
+    # a worker that dies without a word must not leave the request waiting
+    state = server.RenderServer.__new__(server.RenderServer)
+    state.workers = 1
+    state.pool = pool = concurrent.futures.ThreadPoolExecutor(1)
+    messages = queue.Queue()
+    job = concurrent.futures.Future()
+    job.set_exception(concurrent.futures.process.BrokenProcessPool("worker died"))
+    kind, message = asyncio.run(state._next_message(messages, job, pool))
+    assert kind == "error" and "worker died" in message
+    # and the broken pool is replaced, so later requests still work
+    assert isinstance(state.pool, concurrent.futures.ProcessPoolExecutor)
+    state.pool.shutdown()
+
+    # a worker whose client has gone stops instead of filling the queue
+    messages = queue.Queue(1)
+    cancel = threading.Event()
+    cancel.set()
+    start = time.perf_counter()
+    server.render_to_queue(
+        os.path.join(TEST_DIRECTORY, "sounds", "meow.wav"), [], messages, cancel
+    )
+    assert time.perf_counter() - start < 5
+    assert messages.empty()